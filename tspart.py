@@ -22,6 +22,10 @@
 #
 # .PBM -- Portable Bit Map files (Raw or ASCII; P4 or P1)
 #
+# .PGM -- Portable Gray Map files (Raw or ASCII; P5 or P2).  These are
+#         stippled with an ordered dither; see --tones for splitting the
+#         stipples into tonal layers for multiple pens.
+#
 # .PTS -- File of (x, y) or (x, y, radius) coordinates.  Must have as the
 #         first line the literal string
 #
@@ -64,17 +68,31 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from __future__ import print_function
-
 import argparse
 import os
-import subprocess
 import sys
-import tempfile
-import shutil
 
 from tspbitcity import TSPBitCity
-from tspsolution import TSPSolution
+from tsplayers import default_strokes, separate_tones, solve_layers, write_layered_svg
+from tsppipeline import solve
+from tspsolver import SOLVERS
+from tspsupervisor import ProgressBar, echo_output
+
+
+def svg_size_report(stats):
+    """
+    Describe the size of a written SVG file and how much was saved by
+    the compact encoding and compression
+
+    Args:
+        stats (dict): As filled in by TSPBitCity.write_tspsvg()
+    """
+    report = 'done; {:d} bytes'.format(stats['stored'])
+    if stats['stored'] < stats['plain']:
+        report += ', {:.1f}% smaller than the plain SVG of {:d} bytes'.format(
+            100.0 * (stats['plain'] - stats['stored']) / stats['plain'], stats['plain'])
+    return report
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -90,9 +108,30 @@ if __name__ == "__main__":
     parser.add_argument('--mid', help='Produce output with only the SVG preamble (--pre), postamble (--post), or neither (--mid)', action="store_true")
     parser.add_argument('--pre', help='Produce output with only the SVG preamble (--pre), postamble (--post), or neither (--mid)', action="store_true")
     parser.add_argument('--post', help='Produce output with only the SVG preamble (--pre), postamble (--post), or neither (--mid)', action="store_true")
+    parser.add_argument('-C', '--compact', action='store_const', const='gocupi', default=None,
+                        help='Write compact SVG path data which gocupi still reads (drops zero length moves)')
+    parser.add_argument('--full-compact', action='store_const', const='full', dest='compact',
+                        help='Write the shortest SVG path data (h/v shorthands, implicit lineto, fewer separators); '
+                             'not known to be read by gocupi')
+    parser.add_argument('-z', '--svgz', action="store_true",
+                        help='Gzip compress the SVG while writing it; implied by an output file name ending in .svgz')
     parser.add_argument('-r', '--runs', type=int, default=1, help='Number of linkern runs to take')
     parser.add_argument('-s', '--stroke', type=str, default='#000000', help='Stroke (line) color (e.g., black, green, #000000')
     parser.add_argument('-S', '--solver', type=str, default='linkern', help='Path to the linkern executable (example: "linkern" in *nix, "C:/linkern.exe" in Windows')
+    parser.add_argument('-n', '--tones', type=int, default=0,
+                        help='Split the stipples of a PGM file or a coordinate file with radii into this many '
+                             'tonal layers, one per pen, in a single SVG file; ignores --pre, --mid and --post')
+    parser.add_argument('--tone-strokes', type=str, default=None,
+                        help='Comma separated stroke colors of the tonal layers, lightest first; defaults to grays')
+    parser.add_argument('-b', '--backend', type=str, default='linkern', choices=sorted(SOLVERS),
+                        help='Solver backend; "auto" picks one based upon the number of stipples and --time-budget')
+    parser.add_argument('--concorde', type=str, default='concorde', help='Path to the concorde executable')
+    parser.add_argument('-t', '--time-budget', type=float, default=None, help='Seconds the solver may take; an external solver which '
+                             'overruns it is stopped a second later and its best tour so far is used')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='Megabytes of resident memory an external solver may use before it is stopped')
+    parser.add_argument('-P', '--progress', action="store_true",
+                        help='Show a progress bar with the best tour length rather than the solver output')
     args = parser.parse_args()
 
     if args.pre:
@@ -118,25 +157,12 @@ if __name__ == "__main__":
 
     # Now do some fixups, including defaulting the output file name
     raw_path_without_ext, input_ext = os.path.splitext(args.input)
-    filename_without_ext = os.path.split(raw_path_without_ext)[1]
-    if input_ext in ['.pbm', '.pts']:
-        solution_filepath = filename_without_ext + ".tour"
-        if args.output is None:
-            args.output = raw_path_without_ext + '.svg'
-    elif input_ext in ['.PBM', '.PTS']:
-        solution_filepath = filename_without_ext + ".TOUR"
-        if args.output is None:
-            args.output = raw_path_without_ext + '.SVG'
-    else:
-        solution_filepath = filename_without_ext + ".tour"
-        if args.output is None:
-            args.output = raw_path_without_ext + '.svg'
-
-    # Place the solution file into the temporary directory.  We don't need to
-    # worry (too much) about creating it: we're going to make some other calls
-    # to open a temporary file and those calls should instantiate the directory.
-    # And, since we check for errors on those calls, we should catch any problems.
-    solution_filepath = os.path.join(tempfile.gettempdir(), os.path.basename(solution_filepath))
+    if args.output is None:
+        if input_ext in ['.PBM', '.PGM', '.PTS']:
+            args.output = raw_path_without_ext + ('.SVGZ' if args.svgz else '.SVG')
+        else:
+            args.output = raw_path_without_ext + ('.svgz' if args.svgz else '.svg')
+    compress = True if args.svgz else None
 
     # Load the bitmap file
     print('Loading bitmap file {} ... '.format(args.input))
@@ -147,52 +173,76 @@ if __name__ == "__main__":
     if args.count:
         sys.exit(0)
 
-    # Open a temporary file to hold the TSPLIB file
-    tmp_dir = tempfile.mkdtemp()
-    tmp_filename = filename_without_ext + '.tsp'
-    tspfile_path = os.path.join(tmp_dir, tmp_filename)
-
-    # Now write the TSPLIB file
-    print('Writing TSP solver input file {} ... '.format(tspfile_path))
-    cities.write_tspfile(tspfile_path)
-    print('done')
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    solver_options = dict(timeout=args.time_budget, max_memory=max_memory,
+                          linkern=args.solver, concorde=args.concorde, runs=args.runs)
+
+    if args.tones:
+        # Split the stipples into tonal layers, one per pen, solve the
+        # layers concurrently and write them all to a single SVG file
+        try:
+            layers = separate_tones(cities, args.tones)
+        except ValueError as e:
+            sys.stderr.write('{}\n'.format(e))
+            sys.exit(1)
+
+        strokes = args.tone_strokes.split(',') if args.tone_strokes else default_strokes(args.tones)
+        if len(strokes) != args.tones:
+            sys.stderr.write('--tone-strokes must list {:d} colors\n'.format(args.tones))
+            sys.exit(1)
+        labels = ['{} {:d}'.format(args.layer or 'Tone', k + 1) for k in range(args.tones)]
+
+        print('Running TSP solver on {:d} tonal layers ... '.format(args.tones))
+        try:
+            results = solve_layers(layers, args.backend, **solver_options)
+        except RuntimeError as e:
+            sys.stderr.write('{}\n'.format(e))
+            sys.exit(1)
+        for label, layer, result in zip(labels, layers, results):
+            print('{}: {} stipples; solver {} tour length {:d} in {:.2f} seconds{}'.format(
+                label, len(layer.coordinates), result.solver, result.length, result.elapsed,
+                ' (stopped on reaching its {} limit)'.format(result.stopped) if result.stopped else ''))
+
+        print('Writing SVG file {} ... '.format(args.output))
+        stats = {}
+        if not write_layered_svg(args.output, layers, [result.tour for result in results],
+                                 strokes, labels, args.max_segments, args.compact, compress, stats):
+            sys.stderr.write('Error writing SVG file\n')
+            sys.exit(1)
+        print(svg_size_report(stats))
+        sys.exit(0)
 
     # Run the solver
+    # The TSPLIB and tour files are written to (and removed from) the
+    # user's temporary file directory
     print('Running TSP solver ... ')
-    cmd = [args.solver, '-r', str(args.runs), '-o', solution_filepath, tspfile_path]
-    status = subprocess.call(cmd, shell=False)
-
-    # Remove the temporary directory
-    shutil.rmtree(tmp_dir)
-
-    # Did the solver succeed?
-    if status:
-        # No, something went wrong
-        sys.stderr.write('Solver failed; status = {}\n'.format(status))
-        os.unlink(solution_filepath)
-        sys.exit(1)
-
-    # Solver succeeded
-    print('\nSolver finished successfully')
-
-    # Load the solution (a tour)
-    print('Loading solver results from {} ... '.format(solution_filepath))
-    solution = TSPSolution()
-    if not solution.load(solution_filepath):
-        sys.stderr.write('Unable to load the solution file\n')
-        os.unlink(solution_filepath)
+    progress = ProgressBar(args.time_budget) if args.progress else echo_output
+    try:
+        result = solve(cities, args.backend, progress=[progress], **solver_options)
+    except RuntimeError as e:
+        sys.stderr.write('{}\n'.format(e))
         sys.exit(1)
-    print('done')
-
-    # Remove the tour file
-    os.unlink(solution_filepath)
+    finally:
+        if args.progress:
+            progress.close()
+    tour = result.tour
+
+    if result.stopped:
+        # Solver was stopped; the tour is the best one it got to
+        sys.stderr.write('\nSolver {} stopped on reaching its {} limit; best tour found has length {:d}\n'.format(
+            result.solver, result.stopped, result.length))
+    else:
+        # Solver succeeded
+        print('\nSolver {} finished successfully; tour length {:d} in {:.2f} seconds'.format(
+            result.solver, result.length, result.elapsed))
 
     # Now write the SVG file
     print('Writing SVG file {} ... '.format(args.output))
-    if not cities.write_tspsvg(args.output, solution.tour, args.max_segments,
+    stats = {}
+    if not cities.write_tspsvg(args.output, tour, args.max_segments,
                                args.stroke, args.fill, file_contents,
-                               args.layer):
+                               args.layer, args.compact, compress, stats):
         # write_tspsvg() takes care of removing outfile in the case of an error
         sys.stderr.write('Error writing SVG file\n')
         sys.exit(1)
-    print('done')
+    print(svg_size_report(stats))
@@ -37,17 +37,182 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from __future__ import division
-
 import argparse
+import gzip
+import io
 import os
+import re
+import struct
 import sys
-from cgi import escape
+from itertools import chain, compress, islice
+
+from tspindex import TSPSpatialIndex
+
+from html import escape
+
+# Comments in ASCII (P1) PBM files run from a '#' to the end of the line
+_PBM_COMMENT = re.compile(b'#[^\n]*')
+
+# Header fields of PGM files, or the start of a comment ending the line
+_PGM_HEADER_TOKEN = re.compile(b'#|[^\\s#]+')
+
+
+def _bayer_matrix(size):
+    """
+    Ordered dither threshold matrix of size x size, holding the integers
+    0 through size * size - 1; size must be a power of two
+    """
+    matrix = [[0]]
+    while len(matrix) < size:
+        n = len(matrix)
+        matrix = [[4 * matrix[i % n][j % n] + (0, 2, 3, 1)[2 * (i // n) + j // n] for j in range(2 * n)]
+                  for i in range(2 * n)]
+    return matrix
+
+
+# 8x8 Bayer matrix used to dither PGM images
+_BAYER_8X8 = _bayer_matrix(8)
+
+# Comment lines in (x, y, radius) coordinate files
+_XYR_COMMENT = re.compile(b'(?m)^#[^\n]*')
+
+# Number of set bits in each byte value
+_POPCOUNT = bytes(bin(i).count('1') for i in range(256))
+
+# Size of the blocks in which large files are read and written
+_BLOCK_SIZE = 1 << 20
+
+# Size of the blocks in which P4 bitmaps are decoded
+_BITMAP_BLOCK_SIZE = 1 << 14
 
-try:
-    input = raw_input  # Python 2
-except NameError:
-    pass  # Python 3
+# Number of cities formatted at a time when writing TSPLIB files
+_CHUNK_CITIES = 1 << 16
+
+# Translation of the ASCII '0' and '1' pixels of a P1 PBM file to 0 and 1 bytes
+_PBM_P1_BITS = bytes(1 if i == ord('1') else 0 for i in range(256))
+
+
+def iter_tsplib(coordinates, count, name='TSPART', chunk_size=_CHUNK_CITIES):
+    """
+    Generate a TSPLIB file from any iterable of (x, y) coordinates
+
+    Args:
+        coordinates (iterable): City coordinates, possibly a generator
+        count (int): The number of coordinates, needed up front for the header
+        name (str): Value for the NAME field of the header
+        chunk_size (int): Number of cities formatted per chunk
+
+    Yields:
+        str: Successive chunks of the TSPLIB file.  A ValueError is raised
+            should coordinates not hold count cities.
+
+    """
+    # Header
+    yield ('NAME:{}\n'
+           'TYPE:TSP\n'
+           'DIMENSION:{:d}\n'
+           'EDGE_WEIGHT_TYPE:EUC_2D\n'
+           'NODE_COORD_TYPE:TWOD_COORDS\n'
+           'NODE_COORD_SECTION:\n'.format(name, count))
+
+    # list of coordinates, formatted in large batches
+    cities = enumerate(coordinates)
+    city_number = 0
+    while True:
+        chunk = ['%d %d %d\n' % (i, x, y) for i, (x, y) in islice(cities, chunk_size)]
+        if not chunk:
+            break
+        city_number += len(chunk)
+        if city_number > count:
+            break
+        yield ''.join(chunk)
+
+    if city_number != count:
+        raise ValueError('DIMENSION of {:d} does not match the number of cities'.format(count))
+
+    # And finally an EOF record
+    yield 'EOF:\n'
+
+
+def write_tsplib(output, coordinates, count, name='TSPART'):
+    """
+    Write a TSPLIB file; see iter_tsplib()
+
+    Args:
+        output: Path of the file to write or a text file-like object
+    """
+    if hasattr(output, 'write'):
+        for chunk in iter_tsplib(coordinates, count, name):
+            output.write(chunk)
+        return
+
+    with open(output, 'w', _BLOCK_SIZE) as f:
+        for chunk in iter_tsplib(coordinates, count, name):
+            f.write(chunk)
+
+
+# Compact path encodings, see _compact_move()
+COMPACT_MODES = ('gocupi', 'full')
+
+
+def _compact_move(dx, dy, implicit_lineto, mode='full'):
+    """
+    Shortest relative path data for a move by (dx, dy)
+
+    Notes:
+        In either mode a zero length move, which draws nothing, is dropped.
+
+        The 'gocupi' mode otherwise writes the move as the plain encoding
+        does, an implicit lineto pair " dx,dy" with a separator before
+        each number and no other commands, which is all that gocupi's
+        path parser is known to read.
+
+        The 'full' mode writes horizontal and vertical moves with the "h"
+        and "v" commands.  Other moves are "l" pairs, with the "l" itself
+        omitted when the previous command was a lineto or the initial
+        moveto (whose further pairs are implicitly lineto).  The separator
+        before a number is dropped when the number starts with a minus
+        sign.
+
+    Returns:
+        tuple: (path data, whether a following pair may omit the "l")
+
+    """
+    if mode == 'gocupi':
+        if dx == 0 and dy == 0:
+            return '', True
+        return ' {:d},{:d}'.format(dx, dy), True
+    if dy == 0:
+        if dx == 0:
+            return '', implicit_lineto
+        return 'h{:d}'.format(dx), False
+    if dx == 0:
+        return 'v{:d}'.format(dy), False
+    pair = '{:d}{}{:d}'.format(dx, ' ' if dy >= 0 else '', dy)
+    if implicit_lineto:
+        return (' ' if dx >= 0 else '') + pair, True
+    return 'l' + pair, True
+
+
+def open_svg(output_path, compress=None):
+    """
+    Open an SVG file for writing text, gzip compressing it on the fly
+    for .svgz files
+
+    Args:
+        output_path (str): Path of the file
+        compress (bool): Whether to compress; None to decide by the
+            file name extension
+
+    Returns:
+        file: text file object
+
+    """
+    if compress is None:
+        compress = output_path.lower().endswith('.svgz')
+    if compress:
+        return io.TextIOWrapper(gzip.open(output_path, 'wb'), encoding='utf-8')
+    return open(output_path, 'w')
 
 
 class TSPBitCity(object):
@@ -84,15 +249,33 @@ class TSPBitCity(object):
 
         self.coordinates = []
 
-    def _load_pbm_p4(self, f):
+        # Tone of each city, tones[i] belonging to coordinates[i], with
+        # larger values for darker tones.  Only grayscale images (PGM) and
+        # coordinate files with radii carry tone; for other inputs this
+        # list is empty.  See tsplayers.py.
+
+        self.tones = []
+
+        # Spatial index over the coordinates, built on demand by
+        # spatial_index() and dropped whenever the cities are reloaded
+
+        self._index = None
+
+        # Path of the input file whose cities count_cities() loaded in
+        # full, for iter_cities() to use rather than loading them again
+
+        self._counted = None
+
+    def _iter_pbm_p4(self, f):
         """
-        Load a PBM of type P4
-        
+        Stream the cities of a PBM of type P4, a block of bitmap rows at a time
+
         Args:
-            f (io.BinaryIO): File handle for bitmap image 
+            f (io.BinaryIO): File handle for bitmap image, positioned at the bitmap
 
-        Returns:
-            bool:
+        Yields:
+            list: (x, y) coordinates of the lit pixels of the next block of
+                rows.  A ValueError is raised should the bitmap be cut short.
 
         """
         if self.width <= 0:
@@ -100,8 +283,6 @@ class TSPBitCity(object):
         if self.height <= 0:
             raise ValueError("Height of {} must be greater than 0".format(self.infile))
 
-        self.coordinates = []
-
         # PBM file goes from the top of the bitmap (y = h-1) to the
         # bottom of the bitmap (y = 0), and from the left of the bitmap
         # (x = 0) to the right of the bitmap (x = w)
@@ -110,53 +291,45 @@ class TSPBitCity(object):
         # So, each line of the file must be (w + 7) >> 3 bytes long
         nbytes = (self.width + 7) >> 3
 
-        # Each line of the file from here on out corresponds to a
-        # single row of the bitmap
-
-        for row in range(self.height - 1, -1, -1):
-
-            # Read the bitmap row
-            row_bytes = f.read(nbytes)
-
-            # Perform a sanity check
-            if not row_bytes or row_bytes == b'\n':
-                sys.stderr.write('1 Premature end-of-data encountered in {}\n'.format(self.infile))
-                return False
-
-            # And start at the first byte of the line read
-            column_byte_index = 0
+        # Rows are read in blocks of a few kilobytes, which bounds the number
+        # of coordinates held in memory at any one time.  Each row is then
+        # expanded to one '0' or '1' character per pixel by formatting it
+        # as a binary number, and the lit columns are picked out with
+        # compress().  The padding bits at the end of each row fall beyond
+        # the last column and are ignored by compress().
+        bits_format = '0{:d}b'.format(8 * nbytes)
+        columns = range(self.width)
+        rows_per_block = max(1, _BITMAP_BLOCK_SIZE // nbytes)
 
-            # initialize the steps
-            column_byte = row_bytes[column_byte_index]
-            pixel_mask = 0b10000000
+        row = self.height - 1
+        while row >= 0:
+            block = f.read(nbytes * min(rows_per_block, row + 1))
+            if len(block) % nbytes or not block:
+                raise ValueError('Premature end-of-data encountered in {}'.format(self.infile))
 
-            # Now process this row from left to right, x = 0 to x = w - 1
-            for column in range(0, self.width):
+            yield [(column, block_row)
+                   for block_row, start in zip(range(row, -1, -1), range(0, len(block), nbytes))
+                   for column in compress(columns, format(int.from_bytes(block[start:start + nbytes], 'big'),
+                                                          bits_format).encode('ascii').translate(_PBM_P1_BITS))]
+            row -= len(block) // nbytes
 
-                # Hack for Python2 compatibility
-                # Convert the unsigned char byte to an integer
-                if not isinstance(column_byte, int):
-                    column_byte = ord(column_byte)
+    def _load_pbm_p4(self, f):
+        """
+        Load a PBM of type P4
+        
+        Args:
+            f (io.BinaryIO): File handle for bitmap image 
 
-                # See if this bit is lit
-                if pixel_mask & column_byte:
-                    # Bit is lit, save the coordinate of this pixel
-                    self.coordinates.append((column, row))
+        Returns:
+            bool:
 
-                # Now move our bitmask bit to the right by one pixel
-                pixel_mask >>= 1
-
-                # See if it's time to move to the next byte in the input line
-                # Reinitialize the steps
-                if pixel_mask == 0b00000000:
-                    column_byte_index += 1
-                    if column_byte_index < nbytes:
-                        column_byte = row_bytes[column_byte_index]
-                        pixel_mask = 0b10000000
-                    elif column < (self.width - 1):
-                        # Something has gone wrong: we didn't read enough bytes?
-                        sys.stderr.write('2 Premature end-of-file encountered in {}\n'.format(self.infile))
-                        return False
+        """
+        try:
+            self.coordinates = list(chain.from_iterable(self._iter_pbm_p4(f)))
+        except ValueError as e:
+            self.coordinates = []
+            sys.stderr.write('{}\n'.format(e))
+            return False
 
         return True
 
@@ -182,8 +355,8 @@ class TSPBitCity(object):
             That is normal for PBM files of type P1.
     
             Each line from the file may be a portion of one or more rows
-            of the bitmap.  So, it's up to use to track which row and column
-            we are at in the bitmap.
+            of the bitmap.  So, once the comments and whitespace are gone,
+            the rows are recovered from the bitmap width alone.
 
         Args:
             f (io.BinaryIO): File handle for bitmap image 
@@ -197,56 +370,107 @@ class TSPBitCity(object):
         if self.height <= 0:
             raise ValueError("Height of {} must be greater than 0".format(self.infile))
 
-        self.coordinates = []
-
-        # Our column index
-        column = 0
+        # Rather than walking the file a character at a time, read the
+        # remaining payload in one go, strip the comments and whitespace
+        # and then translate the '0' and '1' characters to 0 and 1 bytes.
+        # The lit pixels of each row are then picked out by
+        # itertools.compress() without any per-pixel Python code.
+        bits = _PBM_COMMENT.sub(b'', f.read()).translate(None, b' \t\r\n\v\f')
+
+        if bits.translate(None, b'01'):
+            sys.stderr.write("Invalid content in {}\n".format(self.infile))
+            return False
+
+        npixels = self.width * self.height
+        if len(bits) > npixels:
+            sys.stderr.write('Too much data in {}\n'.format(self.infile))
+            return False
+        if len(bits) < npixels:
+            sys.stderr.write(' Premature end-of-file encountered in {}\n'.format(self.infile))
+            return False
+
+        bits = bits.translate(_PBM_P1_BITS)
+        columns = range(self.width)
+        self.coordinates = [(column, row)
+                            for row, start in zip(range(self.height - 1, -1, -1), range(0, npixels, self.width))
+                            for column in compress(columns, bits[start:start + self.width])]
 
-        # Our row index.  Recall that we start at the top row, row h - 1
-        row = self.height - 1
+        return True
 
-        # Now loop over the remaining lines in the file
-        # Note that the file line of a P1 PBM file usually does not
-        # end with a LF record terminator
+    def _load_pgm(self, f, binary):
+        """
+        Load a PGM (grayscale) image of type P2 or P5 and stipple it by
+        ordered dithering
 
-        for line in f:
+        Notes:
+            Each pixel's darkness, 1 - value / maxval, is compared with
+            an 8x8 Bayer threshold matrix tiled across the image.  Pixels
+            darker than their threshold become cities, and their darkness
+            is saved in self.tones.
 
-            # Ignore semantically empty lines
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
+        Args:
+            f (io.BinaryIO): File handle for the image, positioned after the magic number
+            binary (bool): True for P5 (raw) and False for P2 (ASCII)
 
-            # Too much data in the file?
-            if row < 0:
-                sys.stderr.write('Too much data in {}\n'.format(self.infile))
-                return False
+        Returns:
+            bool:
 
-            # Loop over each byte in the line
-            for each_byte in line:
+        """
+        self.coordinates = []
 
-                if each_byte == '1':
+        # Width, height and maximum gray value, possibly spread over several
+        # lines and interspersed with comments.  The pixel data may start
+        # on the line of the maximum gray value, after a single whitespace
+        # character, and is kept in rest.
+        header = []
+        rest = b''
+        while len(header) < 3:
+            line = f.readline()
+            if not line:
+                sys.stderr.write('Premature end-of-file encountered in {}\n'.format(self.infile))
+                return False
+            for match in _PGM_HEADER_TOKEN.finditer(line):
+                if match.group() == b'#':
+                    break
+                header.append(match.group())
+                if len(header) == 3:
+                    rest = line[match.end():]
+                    if binary:
+                        # Skip the single whitespace character, or a comment
+                        rest = b'' if rest.startswith(b'#') else rest[1:]
+                    break
+        self.width, self.height, maxval = map(int, header)
+        if self.width <= 0 or self.height <= 0 or not 0 < maxval < 65536:
+            sys.stderr.write('Unable to read sensible image dimensions for {}\n'.format(self.infile))
+            return False
+
+        npixels = self.width * self.height
+        if not binary:
+            values = list(map(int, _PBM_COMMENT.sub(b'', rest + f.read()).split()))
+        elif maxval < 256:
+            values = (rest + f.read(max(0, npixels - len(rest))))[:npixels]
+        else:
+            data = (rest + f.read(max(0, 2 * npixels - len(rest))))[:2 * npixels]
+            values = struct.unpack('>{:d}H'.format(len(data) // 2), data)
+        if len(values) < npixels:
+            sys.stderr.write('Premature end-of-file encountered in {}\n'.format(self.infile))
+            return False
+
+        # A pixel becomes a city when its darkness exceeds its threshold or,
+        # equivalently, when its value is below a per-threshold cutoff
+        cutoffs = [[maxval * (1.0 - (b + 0.5) / 64.0) for b in bayer_row] for bayer_row in _BAYER_8X8]
+        darkness = 1.0 / maxval
+
+        columns = range(self.width)
+        for index, row in enumerate(range(self.height - 1, -1, -1)):
+            start = index * self.width
+            row_cutoffs = cutoffs[index % 8] * (self.width // 8 + 1)
+            for column, value, cutoff in zip(columns, values[start:start + self.width], row_cutoffs):
+                if value < cutoff:
                     self.coordinates.append((column, row))
-                elif each_byte != '0':
-                    sys.stderr.write("Invalid content in {}\n".format(self.infile))
-                    return False
+                    self.tones.append(1.0 - value * darkness)
 
-                # Move to the next column
-                column += 1
-
-                # Have we finished this row?
-                if column >= self.width:
-                    # Finished a row, move down to the next row
-                    column = 0
-                    row -= 1
-
-        # All done
-        # Perform a sanity check: we should be at the start of row -1
-        if column == 0 and row == -1:
-            return True
-
-        # Something bad happened
-        sys.stderr.write(' Premature end-of-file encountered in {}\n'.format(self.infile))
-        return False
+        return True
 
     def _load_xyr(self, f):
         """
@@ -259,21 +483,42 @@ class TSPBitCity(object):
         """
         self.coordinates = []
         self.width, self.height = int(self.BOXSIZE), int(self.BOXSIZE)
-        px, py = [], []
 
-        for line in f:
-
-            # Ignore comment lines
-            if line.startswith('#'):
-                continue
-
-            vals = line.strip().split(' ')
-            if len(vals) not in [2, 3]:
+        # Parse the whole payload at once rather than line by line: drop
+        # any comment lines, turn each line end into a ';' token and split
+        # the lot into a single list of tokens.  When every line has the
+        # same number of columns, that list repeats with a period of one
+        # more than the number of columns, with the ';' tokens all in the
+        # last place, and each column is just a strided slice of it.
+        payload = f.read()
+        if b'#' in payload:
+            payload = _XYR_COMMENT.sub(b'', payload)
+        tokens = payload.strip().replace(b'\n', b' ; ').split()
+        nrows = tokens.count(b';') + 1 if tokens else 0
+        tokens.append(b';')
+        ncols = len(tokens) // nrows - 1 if nrows else 0
+        stride = ncols + 1
+
+        if ncols not in [2, 3] or len(tokens) != nrows * stride or tokens[ncols::stride].count(b';') != nrows:
+            # Lines with differing numbers of columns (or blank lines)
+            # so fall back to splitting line by line
+            rows = [line.split() for line in payload.split(b'\n') if line.strip()]
+            if not set(map(len, rows)) <= {2, 3}:
                 sys.stderr.write('Invalid content in file {}\n'.format(self.infile))
                 return False
+            tokens = [value for row in rows for value in row[:2]]
+            ncols = stride = 2
+
+        if not tokens:
+            sys.stderr.write('No coordinates found in file {}\n'.format(self.infile))
+            return False
 
-            px.append(float(vals[0]))
-            py.append(float(vals[1]))
+        px = list(map(float, tokens[0::stride]))
+        py = list(map(float, tokens[1::stride]))
+
+        # Larger stipples stand for darker tones
+        if ncols == 3:
+            self.tones = list(map(float, tokens[2::stride]))
 
         # Find the extrema
         fmin = min(min(px), min(py))
@@ -288,11 +533,40 @@ class TSPBitCity(object):
 
         span = fmax - fmin
         scale = self.BOXSIZE / span if span > 0 else 1
-        # Can't do "for x, y in px, py:" as the lists are too large
-        # resulting in 'too many values to unpack'
-        for i in range(len(px)):
-            self.coordinates.append((int(round((px[i] - fmin) * scale)),
-                                     int(round((py[i] - fmin) * scale))))
+        # float.__round__ rounds exactly as round() does, but without the
+        # dispatch round() makes for every value
+        self.coordinates = list(zip(map(float.__round__, [(x - fmin) * scale for x in px]),
+                                    map(float.__round__, [(y - fmin) * scale for y in py])))
+
+        return True
+
+    def _read_pbm_dimensions(self, f):
+        """
+        Read the width and height line of a PBM file, skipping comments
+
+        Args:
+            f (io.BinaryIO): File handle for bitmap image, positioned after the magic number
+
+        Returns:
+            bool:
+
+        """
+        # Loop until we read the bitmap dimensions
+        # NOTE: we cannot use "while line in f:" since that is incompatible
+        # with later using f.read().  If the file is of type P4, then we
+        # will need to use f.read() to obtain the bitmap
+
+        self.width, self.height = (0, 0)
+        while True:
+            line = f.readline()
+            if not line.startswith(b'#'):
+                self.width, self.height = tuple(map(int, line.split()))
+                break
+
+        # Did we actually read anything (useful)?
+        if not self.width or not self.height:
+            sys.stderr.write('Unable to read sensible bitmap dimensions for {}\n'.format(self.infile))
+            return False
 
         return True
 
@@ -307,98 +581,335 @@ class TSPBitCity(object):
             bool: loading status
 
         """
-        self.infile = infile
-
         # Open the input file
         # This may raise an exception which is fine by us
-        with open(self.infile, 'rb') as f:
-
-            # Get the magic number
-            # For PBM files this will always be two bytes followed by a \n
-            # For other image types, this line could be who knows what.  Hence
-            # our use of a size argument to readline()
-            magic_number = f.readline(4)
-
-            # PBM files must be P1 or P4
-            if magic_number in [b'P4\n', b'P1\n']:
-
-                # File is a PBM bitmap file
-
-                # Loop until we read the bitmap dimensions
-                # NOTE: we cannot use "while line in f:" since that is incompatible
-                # with later using f.read().  If the file is of type P4, then we
-                # will need to use f.read() to obtain the bitmap
-
-                self.width, self.height = (0, 0)
-                while True:
-                    line = f.readline()
-                    if not line.startswith(b'#'):
-                        self.width, self.height = tuple(map(int, line.split()))
-                        break
-
-                # Did we actually read anything (useful)?
-                if not self.width or not self.height:
-                    sys.stderr.write('Unable to read sensible bitmap dimensions for {}\n'.format(self.infile))
-                    return False
-
-                # Now read the bitmap
-                # cities will be a list of 2-tuples, each 2-tuple being the (x, y)
-                # coordinate of a 1 bit in the bitmap.  These (x, y) coordinates
-                # correspond to row and column numbers with
-                #
-                #    0 <= row <= height - 1
-                #    0 <= column <= width - 1
-                #
-                # row = 0 corresponds to the bottom of the bitmap
-                # column = 0 corresponds to the left edge of the bitmap
-
-                ok = self._load_pbm_p4(f) if magic_number == b'P4\n' else self._load_pbm_p1(f)
-
-            elif magic_number == b'# x-':
-
-                # File may be an (x, y, radius) coordinate file
-                line = f.readline().strip()
-                if line != 'coord y-coord radius':
-                    sys.stderr.write('Input file {} is not a supported file type\n'.format(self.infile))
-                    sys.stderr.write('Must be a PBM file or file of (x, y) coordinates. [err=1]\n')
-                    return False
-
-                ok = self._load_xyr(f)
+        with open(infile, 'rb') as f:
+            return self.load_fileobj(f, infile)
 
-            else:
+    def loads(self, data, infile='<bytes>'):
+        """
+        Load cities from the in-memory contents of a PBM or PTS file
+
+        Args:
+            data (bytes): Contents of the bitmap or coordinate file
+            infile (str): Name used in error messages
+
+        Returns:
+            bool: loading status
+
+        """
+        return self.load_fileobj(io.BytesIO(data), infile)
+
+    def load_fileobj(self, f, infile='<stream>'):
+        """
+        Load cities from an already opened file object
+
+        Args:
+            f (io.BinaryIO): File handle for bitmap image, opened in binary mode
+            infile (str): Name used in error messages
+
+        Returns:
+            bool: loading status
+
+        """
+        self.infile = infile
+        self.tones = []
+        self._index = None
+        self._counted = None
+
+        # Get the magic number
+        # For PBM files this will always be two bytes followed by a \n
+        # For other image types, this line could be who knows what.  Hence
+        # our use of a size argument to readline()
+        magic_number = f.readline(4)
+
+        # PBM files must be P1 or P4
+        if magic_number in [b'P4\n', b'P1\n']:
+
+            # File is a PBM bitmap file
+
+            if not self._read_pbm_dimensions(f):
+                return False
+
+            # Now read the bitmap
+            # cities will be a list of 2-tuples, each 2-tuple being the (x, y)
+            # coordinate of a 1 bit in the bitmap.  These (x, y) coordinates
+            # correspond to row and column numbers with
+            #
+            #    0 <= row <= height - 1
+            #    0 <= column <= width - 1
+            #
+            # row = 0 corresponds to the bottom of the bitmap
+            # column = 0 corresponds to the left edge of the bitmap
 
-                # Unsupported file type
+            ok = self._load_pbm_p4(f) if magic_number == b'P4\n' else self._load_pbm_p1(f)
+
+        elif magic_number in [b'P5\n', b'P2\n']:
+
+            # File is a PGM grayscale image
+            ok = self._load_pgm(f, magic_number == b'P5\n')
+
+        elif magic_number == b'# x-':
+
+            # File may be an (x, y, radius) coordinate file
+            line = f.readline().strip()
+            if line != b'coord y-coord radius':
                 sys.stderr.write('Input file {} is not a supported file type\n'.format(self.infile))
-                sys.stderr.write('Must be a PBM file or file of (x, y) coordinates. [err=2]\n')
+                sys.stderr.write('Must be a PBM or PGM file or file of (x, y) coordinates. [err=1]\n')
                 return False
 
+            ok = self._load_xyr(f)
+
+        else:
+
+            # Unsupported file type
+            sys.stderr.write('Input file {} is not a supported file type\n'.format(self.infile))
+            sys.stderr.write('Must be a PBM or PGM file or file of (x, y) coordinates. [err=2]\n')
+            return False
+
         # If ok is False, then __load_xxx() will have printed an error
         # message already
         return ok
 
+    def set_coordinates(self, coordinates, width=None, height=None, infile='<coordinates>', tones=None):
+        """
+        Load cities from an in-memory sequence of (x, y) coordinates
+
+        Args:
+            coordinates (iterable): Integer (x, y) pairs, 0 <= x < width and 0 <= y < height
+            width (int): Width of the map; defaults to one more than the largest x
+            height (int): Height of the map; defaults to one more than the largest y
+            infile (str): Name used in error messages
+            tones (iterable): Optional tone of each city, see self.tones
+
+        Returns:
+            bool: loading status
+
+        """
+        self.infile = infile
+        self.coordinates = [(int(x), int(y)) for x, y in coordinates]
+        self.tones = list(tones) if tones is not None else []
+        self._index = None
+        self._counted = None
+
+        if width is None:
+            width = max(x for x, y in self.coordinates) + 1 if self.coordinates else 0
+        if height is None:
+            height = max(y for x, y in self.coordinates) + 1 if self.coordinates else 0
+        self.width, self.height = int(width), int(height)
+
+        for x, y in self.coordinates:
+            if x < 0 or x >= self.width or y < 0 or y >= self.height:
+                sys.stderr.write('Coordinate ({:d}, {:d}) lies outside of {}\n'.format(x, y, self.infile))
+                return False
+
+        return True
+
+    def spatial_index(self):
+        """
+        Spatial index over the cities for nearest neighbor, radius and
+        rectangle queries.  It is built on first use and kept until the
+        cities are reloaded.
+
+        Returns:
+            tspindex.TSPSpatialIndex: the index
+        """
+        # Also rebuild should the coordinate list have been replaced or
+        # extended behind our back
+        if self._index is None or self._index.coordinates is not self.coordinates or \
+                len(self._index) != len(self.coordinates):
+            self._index = TSPSpatialIndex(self.coordinates)
+        return self._index
+
+    def iter_tspfile(self, infile='TSPART'):
+        """
+        Generate the TSPLIB representation of the cities
+
+        Args:
+            infile (str): Value for the NAME field of the TSPLIB header
+
+        Yields:
+            str: Successive chunks of the TSPLIB file
+
+        """
+        return iter_tsplib(self.coordinates, len(self.coordinates), infile)
+
     def write_tspfile(self, output_path, infile='TSPART'):
-        with open(output_path, 'w') as output:
-            # Header
-            output.write('NAME:{}\n'.format(infile))
-            output.write('TYPE:TSP\n')
-            output.write('DIMENSION:{:d}\n'.format(len(self.coordinates)))
-            output.write('EDGE_WEIGHT_TYPE:EUC_2D\n')
-            output.write('NODE_COORD_TYPE:TWOD_COORDS\n')
-
-            # list of coordinates
-            output.write('NODE_COORD_SECTION:\n')
-            city_number = 0
-            for city in self.coordinates:
-                output.write('{:d} {:d} {:d}\n'.format(city_number, city[0], city[1]))
-                city_number += 1
-
-            # And finally an EOF record
-            output.write('EOF:\n')
+        write_tsplib(output_path, self.coordinates, len(self.coordinates), infile)
+
+    def _open_raw_pbm(self, infile):
+        """
+        Open infile should it be a PBM of type P4, reading up to the bitmap
+
+        Notes:
+            On success the cities of any previously loaded file are
+            dropped, as self.width and self.height now describe infile.
+
+        Returns:
+            io.BinaryIO: the open file, or None if infile is of another type
+        """
+        self.infile = infile
+        f = open(infile, 'rb')
+        if f.readline(4) == b'P4\n':
+            try:
+                if self._read_pbm_dimensions(f):
+                    self.coordinates = []
+                    self.tones = []
+                    self._index = None
+                    self._counted = None
+                    return f
+            except ValueError:
+                pass
+        f.close()
+        return None
+
+    def count_cities(self, infile):
+        """
+        Count the cities of infile without holding them all in memory
+
+        Notes:
+            For raw (P4) PBM files this is a population count of the
+            bitmap, a block at a time, and the cities are not loaded.
+            Other file types are loaded in full, and a following
+            iter_cities() of the same file then reuses the loaded cities.
+
+        Args:
+            infile (str): Path of the input file
+
+        Returns:
+            int: the number of cities, or None if infile could not be read
+
+        """
+        f = self._open_raw_pbm(infile)
+        if f is None:
+            if not self.load(infile):
+                return None
+            self._counted = infile
+            return len(self.coordinates)
+
+        with f:
+            # Any padding bits in the last byte of each row must not be counted
+            nbytes = (self.width + 7) >> 3
+            pad_mask = 0xff >> (self.width % 8) if self.width % 8 else 0
+            padding = bytes(_POPCOUNT[i & pad_mask] for i in range(256))
+            rows_per_block = max(1, _BLOCK_SIZE // nbytes)
+
+            count = 0
+            rows = self.height
+            while rows > 0:
+                block = f.read(nbytes * min(rows_per_block, rows))
+                if len(block) % nbytes or not block:
+                    sys.stderr.write('Premature end-of-data encountered in {}\n'.format(self.infile))
+                    return None
+                count += sum(block.translate(_POPCOUNT))
+                count -= sum(block[nbytes - 1::nbytes].translate(padding))
+                rows -= len(block) // nbytes
+
+        return count
+
+    def iter_cities(self, infile):
+        """
+        Stream the (x, y) coordinates of the cities of infile
+
+        Notes:
+            Raw (P4) PBM files are read a block of rows at a time so that
+            memory use stays constant however large the bitmap.  Other file
+            types are loaded in full first.  self.width and self.height are
+            set by the time the first coordinate is produced.
+
+        Args:
+            infile (str): Path of the input file
+
+        Returns:
+            iterator: (x, y) coordinates in the same order as load() produces
+
+        """
+        return chain.from_iterable(self._iter_city_blocks(infile))
+
+    def _iter_city_blocks(self, infile):
+        if self._counted == infile:
+            # Loaded in full by count_cities() already
+            self._counted = None
+            yield self.coordinates
+            return
+
+        f = self._open_raw_pbm(infile)
+        if f is None:
+            if not self.load(infile):
+                raise ValueError('Unable to load cities from {}'.format(infile))
+            yield self.coordinates
+            return
+
+        with f:
+            for block in self._iter_pbm_p4(f):
+                yield block
+
+    def stream_tspfile(self, infile, output_path, name='TSPART'):
+        """
+        Write the TSPLIB file for infile with constant memory use: a
+        counting pass for the DIMENSION field followed by a second,
+        streaming pass for the coordinates
+
+        Args:
+            infile (str): Path of the input file
+            output_path (str): Path of the TSPLIB file to write
+            name (str): Value for the NAME field of the TSPLIB header
+
+        Returns:
+            bool: success
+
+        """
+        count = self.count_cities(infile)
+        if count is None:
+            return False
+
+        try:
+            write_tsplib(output_path, self.iter_cities(infile), count, name)
+        except ValueError as e:
+            sys.stderr.write('{}\n'.format(e))
+            os.unlink(output_path)
+            return False
+
+        return True
 
     # max_segments == 0 implies unlimited number of segments per path
-    def write_tspsvg(self, output_path, tour, max_segments=400,
-                     line_color='#000000', fill_color='none',
-                     file_contents=3, label=None):
+    def iter_tspsvg(self, tour, max_segments=400,
+                    line_color='#000000', fill_color='none',
+                    file_contents=3, label=None, compact=False, stats=None):
+        """
+        Generate an SVG plot of a tour through the cities
+
+        Args:
+            tour (list): City indices of the tour, see TSPSolution.tour
+            max_segments (int): Maximum number of line segments per <path>
+            line_color (str): Stroke color
+            fill_color (str): Fill color, only used when max_segments is 0
+            file_contents (int): See write_tspsvg()
+            label (str): Inkscape layer name
+            compact (str): None for the plain path encoding, else one of
+                COMPACT_MODES, see _compact_move(); True means 'gocupi'
+            stats (dict): If given, receives 'text', the length of the SVG
+                document, and 'plain', the length it would have without
+                compact.  Filled in once the generator is exhausted.
+
+        Returns:
+            generator: Successive str chunks of the SVG document.  A
+                ValueError is raised from the generator should the tour
+                contain an invalid city index.
+
+        """
+        if max_segments < 0:
+            raise ValueError("Max Segments must be greater or equal to 0.")
+        if compact is True:
+            compact = 'gocupi'
+        elif compact and compact not in COMPACT_MODES:
+            raise ValueError('Unknown compact path encoding {}'.format(compact))
+
+        return self._tspsvg_chunks(tour, max_segments, line_color, fill_color,
+                                   file_contents, label, compact, stats)
+
+    def _tspsvg_chunks(self, tour, max_segments, line_color, fill_color,
+                       file_contents, label, compact, stats):
 
         # File contents explanation:
         # 0: Produce output with neither the SVG preamble or postamble
@@ -406,9 +917,6 @@ class TSPBitCity(object):
         # 2: Produce output with only the SVG postamble
         # 3: Produce output with complete the SVG
 
-        if max_segments < 0:
-            raise ValueError("Max Segments must be greater or equal to 0.")
-
         # max_segments will limit number of points in the path and hence we need
         # Note that previously we ensured that max_segments >= 0
         if max_segments:
@@ -420,107 +928,170 @@ class TSPBitCity(object):
             fill_color = fill_color.strip('"\'')
         if max_segments:
             fill_color = 'none'
-        with open(output_path, 'w') as output:
-
-            # Write the SVG preamble?
-            if file_contents in [1, 3]:
-                output.write(
-                    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
-                    '<!-- Created with the Eggbot TSP art toolkit (http://egg-bot.com) -->\n'
-                    '\n'
-                    '<svg xmlns="http://www.w3.org/2000/svg"\n'
-                    '     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"\n'
-                    '     xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"\n'
-                    '     xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\n'
-                    '     xmlns:dc="http://purl.org/dc/elements/1.1/"\n'
-                    '     xmlns:cc="http://creativecommons.org/ns#"\n'
-                    '     height="{h}"\n'
-                    '     width="{w}">\n'
-                    '  <sodipodi:namedview\n'
-                    '            showgrid="false"\n'
-                    '            showborder="true"\n'
-                    '            inkscape:showpageshadow="false"/>\n'
-                    '  <metadata>\n'
-                    '    <rdf:RDF>\n'
-                    '      <cc:Work rdf:about="">\n'
-                    '        <dc:format>image/svg+xml</dc:format>\n'
-                    '        <dc:type rdf:resource="http://purl.org/dc/dcmitype/StillImage" />\n'
-                    '        <dc:subject>\n'
-                    '          <rdf:Bag>\n'
-                    '            <rdf:li>Egg-Bot</rdf:li>\n'
-                    '            <rdf:li>Eggbot</rdf:li>\n'
-                    '            <rdf:li>TSP</rdf:li>\n'
-                    '            <rdf:li>TSP art</rdf:li>\n'
-                    '          </rdf:Bag>\n'
-                    '        </dc:subject>\n'
-                    '        <dc:description>TSP art created with the Eggbot TSP art toolkit (http://egg-bot.com)</dc:description>\n'
-                    '      </cc:Work>\n'
-                    '    </rdf:RDF>\n'
-                    '  </metadata>\n'.format(h=self.height, w=self.width))
-
-            if label:
-                output.write('inkscape:groupmode="layer" inkscape:label="{}"\n'.format(escape(label, quote=True)))
-
-            output.write('>\n')
-
-            max_index = len(self.coordinates)
-            last_city = None
-            path = False
-            first_path = True
-            points = 0
-
-            for city_idx in tour:
-
-                city_index = int(city_idx)
-                if city_index < 0 or city_index >= max_index:
-                    sys.stderr.write('TSP tour contains an invalid city index, {}\n'.format(city_index))
-                    os.unlink(output_path)
-                    return False
-
-                if not path:
-                    # We need to start a new path whose first point is the
-                    # last city we moved to
-                    path = True
-                    if not last_city:
-                        last_city = self.coordinates[city_index]
-
-                    last_city_y = self.height - last_city[1]
-                    output.write('    <path style="fill:{};stroke:{};stroke-width:1"\n'.format(fill_color, line_color) +
-                                 '          d="m {:d},{:d}'.format(last_city[0], last_city_y))
-                    if points == 0:
-                        # This is the first path so skip the next step
-                        continue
-
-                # Now move to the current city
-                next_city = self.coordinates[city_index]
-                next_city_x = next_city[0] - last_city[0]
-                next_city_y = (next_city[1] - last_city[1]) * -1
-
-                output.write(' {:d},{:d}'.format(next_city_x, next_city_y))
-                last_city = next_city
-                points += 1
-
-                if max_segments and points > max_segments:
-                    # Start a new path
-                    path = False
-                    first_path = False
-                    points = 1  # 1 and not 0
-                    output.write('"/>\n')
-
-            # Close out any open path
-            if path:
-                if first_path:
-                    # Make sure it's known that this is a single, closed path
-                    # Note: if we wrote a single path but closed it out because
-                    # len(tour) == max_segments + 1, then this final 'Z' will be omitted
-                    # which should be okay anyway.
-                    output.write(' Z"/>\n')
+
+        # Output is accumulated here and handed out in large chunks
+        # rather than one tiny string per city
+        output = []
+
+        # Number of characters produced, and the number which the plain
+        # path encoding would have needed
+        text = 0
+        saved = 0
+
+        # Write the SVG preamble?
+        if file_contents in [1, 3]:
+            output.append('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+                          '<!-- Created with the Eggbot TSP art toolkit (http://egg-bot.com) -->\n'
+                          '\n'
+                          '<svg xmlns="http://www.w3.org/2000/svg"\n'
+                          '     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"\n'
+                          '     xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"\n'
+                          '     xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\n'
+                          '     xmlns:dc="http://purl.org/dc/elements/1.1/"\n'
+                          '     xmlns:cc="http://creativecommons.org/ns#"\n'
+                          '     height="{h}"\n'
+                          '     width="{w}">\n'
+                          '  <sodipodi:namedview\n'
+                          '            showgrid="false"\n'
+                          '            showborder="true"\n'
+                          '            inkscape:showpageshadow="false"/>\n'
+                          '  <metadata>\n'
+                          '    <rdf:RDF>\n'
+                          '      <cc:Work rdf:about="">\n'
+                          '        <dc:format>image/svg+xml</dc:format>\n'
+                          '        <dc:type rdf:resource="http://purl.org/dc/dcmitype/StillImage" />\n'
+                          '        <dc:subject>\n'
+                          '          <rdf:Bag>\n'
+                          '            <rdf:li>Egg-Bot</rdf:li>\n'
+                          '            <rdf:li>Eggbot</rdf:li>\n'
+                          '            <rdf:li>TSP</rdf:li>\n'
+                          '            <rdf:li>TSP art</rdf:li>\n'
+                          '          </rdf:Bag>\n'
+                          '        </dc:subject>\n'
+                          '        <dc:description>TSP art created with the Eggbot TSP art toolkit (http://egg-bot.com)</dc:description>\n'
+                          '      </cc:Work>\n'
+                          '    </rdf:RDF>\n'
+                          '  </metadata>\n'.format(h=self.height, w=self.width))
+
+        # Place the paths in an Inkscape layer?
+        if label:
+            output.append('  <g inkscape:groupmode="layer" inkscape:label="{}">\n'.format(escape(label, quote=True)))
+
+        max_index = len(self.coordinates)
+        last_city = None
+        path = False
+        first_path = True
+        points = 0
+
+        for city_idx in tour:
+
+            city_index = int(city_idx)
+            if city_index < 0 or city_index >= max_index:
+                sys.stderr.write('TSP tour contains an invalid city index, {}\n'.format(city_index))
+                raise ValueError('Invalid city index {} in tour'.format(city_index))
+
+            if not path:
+                # We need to start a new path whose first point is the
+                # last city we moved to
+                path = True
+                if not last_city:
+                    last_city = self.coordinates[city_index]
+
+                last_city_y = self.height - last_city[1]
+                output.append('    <path style="fill:{};stroke:{};stroke-width:1"\n'.format(fill_color, line_color))
+                if compact == 'full':
+                    # "m x y" rather than "m x,y"; later pairs are implicitly "l"
+                    output.append('          d="m{:d}{}{:d}'.format(last_city[0], ' ' if last_city_y >= 0 else '',
+                                                                  last_city_y))
+                    saved += 1 if last_city_y >= 0 else 2
                 else:
-                    output.write('"/>\n')
+                    output.append('          d="m {:d},{:d}'.format(last_city[0], last_city_y))
+                implicit_lineto = True
+                if points == 0:
+                    # This is the first path so skip the next step
+                    continue
+
+            # Now move to the current city
+            next_city = self.coordinates[city_index]
+            next_city_x = next_city[0] - last_city[0]
+            next_city_y = (next_city[1] - last_city[1]) * -1
+
+            if compact:
+                move, implicit_lineto = _compact_move(next_city_x, next_city_y, implicit_lineto, compact)
+                saved += len(str(next_city_x)) + len(str(next_city_y)) + 2 - len(move)
+                last_city = next_city
+                # A zero length move to a duplicate city draws nothing but
+                # is still counted below so that the paths are split where
+                # the plain encoding splits them
+                if move:
+                    output.append(move)
+            else:
+                output.append(' {:d},{:d}'.format(next_city_x, next_city_y))
+                last_city = next_city
+            points += 1
+
+            if max_segments and points > max_segments:
+                # Start a new path
+                path = False
+                first_path = False
+                points = 1  # 1 and not 0
+                output.append('"/>\n')
+
+            if len(output) >= 8192:
+                chunk = ''.join(output)
+                text += len(chunk)
+                yield chunk
+                output = []
+
+        # Close out any open path
+        if path:
+            if first_path:
+                # Make sure it's known that this is a single, closed path
+                # Note: if we wrote a single path but closed it out because
+                # len(tour) == max_segments + 1, then this final 'Z' will be omitted
+                # which should be okay anyway.
+                output.append('z"/>\n' if compact == 'full' else ' Z"/>\n')
+                saved += 1 if compact == 'full' else 0
+            else:
+                output.append('"/>\n')
+
+        if label:
+            output.append('  </g>\n')
 
-            # Write the SVG postamble?
-            if int(file_contents) in [2, 3]:
-                output.write('</svg>\n')
+        # Write the SVG postamble?
+        if int(file_contents) in [2, 3]:
+            output.append('</svg>\n')
+
+        chunk = ''.join(output)
+        text += len(chunk)
+        if stats is not None:
+            stats['text'] = text
+            stats['plain'] = text + saved
+        yield chunk
+
+    # max_segments == 0 implies unlimited number of segments per path
+    def write_tspsvg(self, output_path, tour, max_segments=400,
+                     line_color='#000000', fill_color='none',
+                     file_contents=3, label=None, compact=False,
+                     compress=None, stats=None):
+
+        # compress: gzip the SVG as it is written.  When None, files named
+        #   *.svgz are compressed and others are not.
+        # stats: as for iter_tspsvg(), plus 'stored', the size of the file
+
+        chunks = self.iter_tspsvg(tour, max_segments, line_color, fill_color,
+                                  file_contents, label, compact, stats)
+        try:
+            with open_svg(output_path, compress) as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        except ValueError:
+            # The tour contained an invalid city index
+            os.unlink(output_path)
+            return False
+
+        if stats is not None:
+            stats['stored'] = os.path.getsize(output_path)
 
         return True
 
@@ -549,8 +1120,7 @@ if __name__ == '__main__':
         else:
             args.output = raw_path_without_ext + '.tsp'
 
+    # Stream the cities straight from the input to the TSPLIB file
     citymap = TSPBitCity()
-    if not citymap.load(args.input):
+    if not citymap.stream_tspfile(args.input, args.output):
         sys.exit(1)
-
-    citymap.write_tspfile(args.output)
@@ -0,0 +1,237 @@
+# coding=utf-8
+# tspindex.py
+#
+# Uniform grid spatial index over city coordinates.  The cities are bucketed
+# into square cells sized so that each cell holds a couple of cities on
+# average.  Queries then only look at the cells near the query point rather
+# than at every city.
+#
+# The index of a TSPBitCity is best obtained with TSPBitCity.spatial_index(),
+# which builds it on first use and rebuilds it after the cities are reloaded.
+#
+#    index = cities.spatial_index()
+#    index.nearest(x, y, k=5)            # five nearest cities
+#    index.within(x, y, 10)              # cities no further than 10 away
+#    index.in_box(0, 0, 99, 99)          # cities in a rectangle
+#    index.nearest_many(points, k=1)     # bulk form of nearest()
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import heapq
+import math
+
+
+class TSPSpatialIndex(object):
+    def __init__(self, coordinates, cell_size=None):
+        """
+        Args:
+            coordinates (list): City (x, y) coordinates; query results are
+                indices into this list
+            cell_size (float): Width and height of the grid cells; by default
+                chosen to put about two cities in each cell
+        """
+        self.coordinates = coordinates
+
+        # Number of cities bucketed; cities appended to coordinates later
+        # are not in the index
+        self.count = len(coordinates)
+
+        if coordinates:
+            xs = [city[0] for city in coordinates]
+            ys = [city[1] for city in coordinates]
+            self.xmin, self.xmax = min(xs), max(xs)
+            self.ymin, self.ymax = min(ys), max(ys)
+        else:
+            self.xmin = self.xmax = self.ymin = self.ymax = 0
+
+        if cell_size is None:
+            area = (self.xmax - self.xmin + 1) * (self.ymax - self.ymin + 1)
+            cell_size = math.sqrt(2.0 * area / max(1, len(coordinates)))
+        self.cell_size = max(1.0, float(cell_size))
+
+        # Cells are keyed by their (column, row) in the grid and hold the
+        # indices of the cities within them
+        self.cells = {}
+        for i, (x, y) in enumerate(coordinates):
+            self.cells.setdefault(self._cell(x, y), []).append(i)
+
+        # Extent of the grid in cells
+        self.cxmin, self.cymin = self._cell(self.xmin, self.ymin)
+        self.cxmax, self.cymax = self._cell(self.xmax, self.ymax)
+
+    def __len__(self):
+        return self.count
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _ring(self, cx, cy, r):
+        # Cells of the grid at Chebyshev distance r from cell (cx, cy).
+        # Cells outside the grid's extent hold no cities and are skipped.
+        if r == 0:
+            yield cx, cy
+            return
+        i0, i1 = max(cx - r, self.cxmin), min(cx + r, self.cxmax)
+        for j in (cy - r, cy + r):
+            if self.cymin <= j <= self.cymax:
+                for i in range(i0, i1 + 1):
+                    yield i, j
+        j0, j1 = max(cy - r + 1, self.cymin), min(cy + r - 1, self.cymax)
+        for i in (cx - r, cx + r):
+            if self.cxmin <= i <= self.cxmax:
+                for j in range(j0, j1 + 1):
+                    yield i, j
+
+    def nearest(self, x, y, k=1):
+        """
+        Find the k cities nearest to (x, y)
+
+        Args:
+            x (float): x coordinate of the query point
+            y (float): y coordinate of the query point
+            k (int): number of cities wanted
+
+        Returns:
+            list: indices of up to k cities, nearest first
+
+        """
+        k = min(k, self.count)
+        if k <= 0:
+            return []
+
+        coordinates = self.coordinates
+        cells = self.cells
+        cx, cy = self._cell(x, y)
+
+        # Rings of cells are searched outward from the query point's cell.
+        # Cities beyond ring r are at least r cell widths away, so the
+        # search ends once the kth best is no further away than that.  The
+        # rings short of the grid are empty, so a query point outside the
+        # grid starts at the first ring reaching it.
+        last_ring = max(abs(cx - self.cxmin), abs(cx - self.cxmax), abs(cy - self.cymin), abs(cy - self.cymax))
+        best = []  # max-heap of (-squared distance, index)
+        r = max(self.cxmin - cx, cx - self.cxmax, self.cymin - cy, cy - self.cymax, 0)
+        while True:
+            for cell in self._ring(cx, cy, r):
+                for i in cells.get(cell, ()):
+                    dx, dy = coordinates[i][0] - x, coordinates[i][1] - y
+                    d = dx * dx + dy * dy
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+
+            reach = r * self.cell_size
+            if r >= last_ring or (len(best) == k and -best[0][0] <= reach * reach):
+                break
+            r += 1
+
+        return [i for _, i in sorted(best, key=lambda item: (-item[0], item[1]))]
+
+    def within(self, x, y, radius):
+        """
+        Find the cities no further than radius from (x, y)
+
+        Returns:
+            list: indices of the cities, in no particular order
+        """
+        coordinates = self.coordinates
+        r2 = radius * radius
+        return [i for i in self._candidates(x - radius, y - radius, x + radius, y + radius)
+                if (coordinates[i][0] - x) ** 2 + (coordinates[i][1] - y) ** 2 <= r2]
+
+    def in_box(self, xmin, ymin, xmax, ymax):
+        """
+        Find the cities within a rectangle, edges included
+
+        Returns:
+            list: indices of the cities, in no particular order
+        """
+        coordinates = self.coordinates
+        return [i for i in self._candidates(xmin, ymin, xmax, ymax)
+                if xmin <= coordinates[i][0] <= xmax and ymin <= coordinates[i][1] <= ymax]
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        # Cities in the cells overlapping a rectangle, clipped to the grid
+        cx0, cy0 = self._cell(xmin, ymin)
+        cx1, cy1 = self._cell(xmax, ymax)
+        cx0, cy0 = max(cx0, self.cxmin), max(cy0, self.cymin)
+        cx1, cy1 = min(cx1, self.cxmax), min(cy1, self.cymax)
+        cells = self.cells
+        for i in range(cx0, cx1 + 1):
+            for j in range(cy0, cy1 + 1):
+                for city in cells.get((i, j), ()):
+                    yield city
+
+    def nearest_many(self, points, k=1):
+        """
+        Bulk form of nearest()
+
+        Args:
+            points (iterable): (x, y) query points
+            k (int): number of cities wanted per point
+
+        Returns:
+            list: for each point, the list returned by nearest()
+
+        """
+        nearest = self.nearest
+        return [nearest(x, y, k) for x, y in points]
+
+    def within_many(self, points, radius):
+        """
+        Bulk form of within()
+        """
+        within = self.within
+        return [within(x, y, radius) for x, y in points]
+
+    def in_boxes(self, boxes):
+        """
+        Bulk form of in_box()
+
+        Args:
+            boxes (iterable): (xmin, ymin, xmax, ymax) rectangles
+        """
+        in_box = self.in_box
+        return [in_box(*box) for box in boxes]
+
+    def neighbors(self, k):
+        """
+        Candidate lists: the k nearest other cities of every city
+
+        Returns:
+            list: neighbors[i] lists the indices of the k cities nearest
+                to city i, nearest first, city i itself excluded
+        """
+        return [[j for j in self.nearest(x, y, k + 1) if j != i][:k]
+                for i, (x, y) in enumerate(self.coordinates)]
+
+    def duplicates(self):
+        """
+        Find cities sharing the same coordinates
+
+        Returns:
+            list: lists of the indices of cities at the same position, one
+                list per position shared by two or more cities
+        """
+        groups = []
+        for members in self.cells.values():
+            if len(members) < 2:
+                continue
+            at = {}
+            for i in members:
+                at.setdefault(tuple(self.coordinates[i]), []).append(i)
+            groups += [sorted(same) for same in at.values() if len(same) > 1]
+        return sorted(groups)
@@ -0,0 +1,177 @@
+# coding=utf-8
+# tsplayers.py
+#
+# Tonal separation for multi-pen TSP art.  The stipples of a single input
+# are split into N layers by tone, from the lightest to the darkest.  A tour
+# is found for each layer, with the layers solved concurrently in a pool of
+# processes, and the tours are then written to a single SVG file with one
+# Inkscape layer per pen.
+#
+# Tone is only known for inputs which carry it: PGM (grayscale) images,
+# where it is the darkness of the stippled pixel, and coordinate files with
+# radii, where it is the stipple radius.  See TSPBitCity.tones.
+#
+#    python tspart.py --tones 3 image.pgm
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tspbitcity import TSPBitCity, open_svg
+from tspsolver import get_solver
+
+
+def separate_tones(cities, ntones):
+    """
+    Split cities into layers of roughly equal size by tone
+
+    Args:
+        cities (TSPBitCity): Cities with tones, see TSPBitCity.tones
+        ntones (int): Number of layers
+
+    Returns:
+        list: ntones TSPBitCity instances, ordered from lightest to darkest
+            tone.  Each layer has the width and height of cities.
+
+    """
+    if ntones < 1:
+        raise ValueError('The number of tones must be at least 1')
+    if len(cities.tones) != len(cities.coordinates):
+        raise ValueError('{} carries no tone information; use a PGM file or a '
+                         'coordinate file with radii'.format(cities.infile))
+
+    # Cut the cities, sorted by tone, into ntones consecutive runs.  This
+    # keeps the layers (and hence their solve times) similar in size.
+    order = sorted(range(len(cities.coordinates)), key=cities.tones.__getitem__)
+    layers = []
+    for k in range(ntones):
+        members = sorted(order[len(order) * k // ntones:len(order) * (k + 1) // ntones])
+        layer = TSPBitCity()
+        layer.set_coordinates([cities.coordinates[i] for i in members], cities.width, cities.height,
+                              '{} (tone {:d})'.format(cities.infile, k + 1),
+                              [cities.tones[i] for i in members])
+        layers.append(layer)
+
+    return layers
+
+
+def _solve_layer(coordinates, width, height, backend, options):
+    # Runs in a worker process
+    layer = TSPBitCity()
+    layer.set_coordinates(coordinates, width, height)
+    return get_solver(backend, **options).solve(layer)
+
+
+def solve_layers(layers, backend='linkern', workers=None, **options):
+    """
+    Find a tour for each layer, solving the layers concurrently
+
+    Args:
+        layers (list): TSPBitCity instances
+        backend (str): Name of the solver backend, see tspsolver.py
+        workers (int): Number of worker processes; defaults to the number
+            of CPUs
+        **options: See tspsolver.TSPSolver
+
+    Returns:
+        list: tspsolver.TSPSolverResult for each layer, in the order of layers
+
+    """
+    if not layers:
+        return []
+
+    # Hand out the largest layers first so that the overall wall clock
+    # time is close to that of the largest layer
+    workers = min(len(layers), workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for k in sorted(range(len(layers)), key=lambda k: -len(layers[k].coordinates)):
+            futures[k] = pool.submit(_solve_layer, layers[k].coordinates, layers[k].width,
+                                     layers[k].height, backend, options)
+        return [futures[k].result() for k in range(len(layers))]
+
+
+def default_strokes(ntones):
+    """
+    Pen colors for ntones layers: grays from light gray to black
+
+    Returns:
+        list: ntones '#rrggbb' colors, lightest first
+    """
+    if ntones == 1:
+        return ['#000000']
+    grays = [int(round(0xc0 * (ntones - 1 - k) / (ntones - 1))) for k in range(ntones)]
+    return ['#{0:02x}{0:02x}{0:02x}'.format(gray) for gray in grays]
+
+
+def iter_layered_svg(layers, tours, strokes, labels, max_segments=400, compact=False, stats=None):
+    """
+    Generate a single SVG document with one Inkscape layer per tour
+
+    Args:
+        layers (list): TSPBitCity instances
+        tours (list): Closed tour for each layer
+        strokes (list): Stroke color for each layer
+        labels (list): Inkscape layer name for each layer
+        max_segments (int): See TSPBitCity.write_tspsvg()
+        compact (str): See TSPBitCity.iter_tspsvg()
+        stats (dict): See TSPBitCity.iter_tspsvg(); totals over all layers
+
+    Yields:
+        str: Successive chunks of the SVG document
+
+    """
+    if stats is not None:
+        stats['text'] = stats['plain'] = 0
+
+    last = len(layers) - 1
+    for k, layer in enumerate(layers):
+        # Only the first layer writes the SVG preamble and only the
+        # last layer writes the postamble
+        file_contents = (1 if k == 0 else 0) | (2 if k == last else 0)
+        layer_stats = {}
+        for chunk in layer.iter_tspsvg(tours[k], max_segments, strokes[k], 'none',
+                                       file_contents, labels[k], compact, layer_stats):
+            yield chunk
+        if stats is not None:
+            stats['text'] += layer_stats['text']
+            stats['plain'] += layer_stats['plain']
+
+
+def write_layered_svg(output_path, layers, tours, strokes, labels, max_segments=400,
+                      compact=False, compress=None, stats=None):
+    """
+    Write the SVG document of iter_layered_svg() to a file
+
+    Args:
+        compress (bool): See TSPBitCity.write_tspsvg()
+        stats (dict): See TSPBitCity.write_tspsvg()
+
+    Returns:
+        bool: False if a tour was invalid, in which case no file is left behind
+    """
+    try:
+        with open_svg(output_path, compress) as output:
+            for chunk in iter_layered_svg(layers, tours, strokes, labels, max_segments, compact, stats):
+                output.write(chunk)
+    except ValueError:
+        os.unlink(output_path)
+        return False
+
+    if stats is not None:
+        stats['stored'] = os.path.getsize(output_path)
+
+    return True
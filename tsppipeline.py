@@ -0,0 +1,188 @@
+# coding=utf-8
+# tsppipeline.py
+#
+# Programmatic interface to the TSP art pipeline of tspart.py:
+#
+#    stipples --> TSPLIB file --> TSP solver --> tour --> SVG
+#
+# The inputs may be bitmap file contents (bytes), file-like objects, file
+# paths or plain sequences of (x, y) coordinates.  The results are the tour
+# and the SVG document, either as bytes or as an iterator of byte chunks.
+# The disk is only touched when an external solver requires it: the
+# TSPLIB file and the tour file are kept in a private temporary directory
+# which is removed once the solver has finished.  The solver backends
+# themselves live in tspsolver.py.
+#
+# Example:
+#
+#    from tsppipeline import tspart
+#    tour, svg = tspart(open('image.pbm', 'rb').read())
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import zlib
+
+from tspbitcity import TSPBitCity
+from tspsolver import get_solver
+
+
+def load_cities(source, width=None, height=None):
+    """
+    Build a TSPBitCity from any of the supported kinds of input
+
+    Args:
+        source: One of
+            - a TSPBitCity, returned as is
+            - a str, taken to be the path of a PBM or PTS file
+            - bytes or bytearray, the contents of a PBM or PTS file
+            - a binary file-like object positioned at the start of a PBM or PTS file
+            - an iterable of integer (x, y) coordinates
+        width (int): Map width for coordinate input; see TSPBitCity.set_coordinates()
+        height (int): Map height for coordinate input; see TSPBitCity.set_coordinates()
+
+    Returns:
+        TSPBitCity: the loaded cities
+
+    """
+    if isinstance(source, TSPBitCity):
+        return source
+
+    cities = TSPBitCity()
+    if isinstance(source, str):
+        ok = cities.load(source)
+    elif isinstance(source, (bytes, bytearray)):
+        ok = cities.loads(bytes(source))
+    elif hasattr(source, 'read'):
+        ok = cities.load_fileobj(source, getattr(source, 'name', '<stream>'))
+    else:
+        ok = cities.set_coordinates(source, width, height)
+
+    # The loaders have already reported the specifics on stderr
+    if not ok:
+        raise ValueError('Unable to load cities from {}'.format(cities.infile))
+
+    return cities
+
+
+def solve(cities, backend='linkern', **options):
+    """
+    Find a tour through the cities with one of the solver backends
+
+    Args:
+        cities (TSPBitCity): Cities to visit
+        backend (str): Name of the solver backend, see tspsolver.py
+        **options: Time and memory limits and backend options; see
+            tspsolver.TSPSolver
+
+    Returns:
+        tspsolver.TSPSolverResult: the tour, its length and the solve time
+
+    """
+    solver = get_solver(backend, **options)
+    if not solver.available():
+        raise RuntimeError('Solver backend {} is not available'.format(solver.name))
+    return solver.solve(cities)
+
+
+def solve_tour(cities, solver='linkern', runs=1, backend='linkern', **options):
+    """
+    Same as solve() but returns only the closed tour
+
+    Args:
+        cities (TSPBitCity): Cities to visit
+        solver (str): Path to the linkern executable
+        runs (int): Number of linkern runs to take
+        backend (str): Name of the solver backend, see tspsolver.py
+        **options: See solve()
+
+    Returns:
+        list: The closed tour, see TSPSolution.tour
+
+    """
+    return solve(cities, backend, linkern=solver, runs=runs, **options).tour
+
+
+def iter_svg(cities, tour, max_segments=400, line_color='#000000',
+             fill_color='none', file_contents=3, label=None, compact=False,
+             compress=False):
+    """
+    Stream the SVG plot of a tour
+
+    Args:
+        cities (TSPBitCity): Cities visited by the tour
+        tour (list): City indices of the tour
+        max_segments, line_color, fill_color, file_contents, label, compact:
+            See TSPBitCity.iter_tspsvg()
+        compress (bool): Gzip the stream, as for a .svgz file
+
+    Yields:
+        bytes: Successive UTF-8 encoded chunks of the SVG document
+
+    """
+    chunks = cities.iter_tspsvg(tour, max_segments, line_color, fill_color,
+                                file_contents, label, compact)
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+
+    # wbits of 16 + MAX_WBITS selects the gzip container
+    gzipper = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = gzipper.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield gzipper.flush()
+
+
+def render_svg(cities, tour, max_segments=400, line_color='#000000',
+               fill_color='none', file_contents=3, label=None, compact=False,
+               compress=False):
+    """
+    Same as iter_svg() but returns the complete SVG document as bytes
+    """
+    return b''.join(iter_svg(cities, tour, max_segments, line_color,
+                             fill_color, file_contents, label, compact,
+                             compress))
+
+
+def tspart(source, solver='linkern', runs=1, max_segments=400,
+           line_color='#000000', fill_color='none', file_contents=3,
+           label=None, stream=False, backend='linkern', compact=False,
+           compress=False, **options):
+    """
+    Turn stipples into TSP art in one call
+
+    Args:
+        source: Stipples; see load_cities()
+        solver (str): Path to the linkern executable
+        runs (int): Number of linkern runs to take
+        max_segments, line_color, fill_color, file_contents, label:
+            See TSPBitCity.write_tspsvg()
+        stream (bool): Return the SVG as an iterator of bytes chunks
+            rather than as a single bytes object
+        backend (str): Name of the solver backend, see tspsolver.py
+        compact, compress: See iter_svg()
+        **options: See solve()
+
+    Returns:
+        tuple: (tour, svg)
+
+    """
+    cities = load_cities(source)
+    tour = solve_tour(cities, solver, runs, backend, **options)
+    render = iter_svg if stream else render_svg
+    return tour, render(cities, tour, max_segments, line_color, fill_color,
+                        file_contents, label, compact, compress)
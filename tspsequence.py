@@ -0,0 +1,243 @@
+# coding=utf-8
+# tspsequence.py
+#
+# TSP art for frame sequences, e.g., stop-motion animations.  Consecutive
+# frames of such a sequence differ only slightly, so rather than solving
+# each frame from scratch, the tour of the previous frame is carried over
+# to the next: each city of the new frame is matched with the nearest
+# city of the previous frame (found with the grid of tspindex.py) and
+# takes that city's place along the tour.  The solver then only has to
+# repair the carried over tour, which is much quicker than building one.
+#
+# The frames are processed as a pipeline: while one frame is being
+# solved, the following frames are loaded and the SVG files of the
+# preceding frames are written.
+#
+#    python tspsequence.py -o frames/ frame0001.pbm frame0002.pbm ...
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from tsppipeline import load_cities
+from tspsolver import SOLVERS, LinkernSolver, get_solver
+
+# linkern kicks per changed city when starting a frame from the previous
+# frame's tour.  A frame which barely changed needs little more than the
+# repair linkern makes of the initial tour itself.
+WARM_KICKS_PER_CHANGED_CITY = 2
+
+
+def transfer_tour(previous, previous_tour, cities, stats=None):
+    """
+    Carry the tour of one frame over to the cities of the next frame
+
+    Each city is matched with the nearest city of the previous frame and
+    the cities are then ordered by the tour position of their matches.
+    Cities sharing a match are ordered by their distance to the match's
+    successor along the tour, furthest first.  Cities of the previous
+    frame left without a match simply drop out of the tour.
+
+    Args:
+        previous (TSPBitCity): Cities of the previous frame
+        previous_tour (list): Tour, open or closed, of the previous frame
+        cities (TSPBitCity): Cities of the next frame
+        stats (dict): When given, receives under 'changed' the number of
+            cities which moved, appeared or disappeared from one frame to
+            the next
+
+    Returns:
+        list: Open tour of cities, or None when the previous frame has
+            no cities to match with
+
+    """
+    coordinates = previous.coordinates
+    count = len(coordinates)
+    if not count or not cities.coordinates:
+        return None
+
+    tour = list(previous_tour)
+    if len(tour) == count + 1:
+        tour.pop()
+    position = [0] * count
+    for k, i in enumerate(tour):
+        position[i] = k
+
+    matches = [nearest[0] for nearest in previous.spatial_index().nearest_many(cities.coordinates, 1)]
+
+    if stats is not None:
+        # Cities whose match lies elsewhere moved; cities sharing a match
+        # appeared and cities left without one disappeared
+        matched = len(set(matches))
+        moved = sum(1 for j, match in enumerate(matches) if tuple(coordinates[match]) != tuple(cities.coordinates[j]))
+        stats['changed'] = moved + (len(matches) - matched) + (count - matched)
+
+    def key(j):
+        x, y = cities.coordinates[j]
+        k = position[matches[j]]
+        successor = coordinates[tour[(k + 1) % count]]
+        return k, -math.hypot(successor[0] - x, successor[1] - y)
+
+    return sorted(range(len(cities.coordinates)), key=key)
+
+
+def _write_frame(cities, tour, output_path, max_segments, line_color, compact, compress):
+    # Runs in a worker thread
+    if not cities.write_tspsvg(output_path, tour, max_segments, line_color, 'none', 3,
+                               None, compact, compress):
+        raise RuntimeError('Error writing SVG file {}'.format(output_path))
+    return output_path
+
+
+def solve_sequence(sources, output_paths=None, backend='linkern', warm_timeout=None, prefetch=2,
+                   max_segments=400, line_color='#000000', compact=False, compress=None, **options):
+    """
+    Find a tour for each frame of a sequence, starting each frame from the
+    tour of the frame before it
+
+    Args:
+        sources (list): The frames, in order; see tsppipeline.load_cities()
+        output_paths (list): SVG file to write for each frame; None to
+            write no files
+        backend (str): Name of the solver backend, see tspsolver.py
+        warm_timeout (float): Seconds the solver may take on the frames
+            after the first; defaults to the timeout option
+        prefetch (int): Number of frames loaded ahead of the frame being
+            solved
+        max_segments, line_color, compact, compress: See
+            TSPBitCity.write_tspsvg()
+        **options: See tspsolver.TSPSolver.  Unless warm_kicks is given,
+            linkern's kicks on the frames after the first are scaled to the
+            number of cities which changed; see WARM_KICKS_PER_CHANGED_CITY.
+
+    Yields:
+        tuple: (cities, result, warm) for each frame, in order, as soon as
+            it is solved: the TSPBitCity, the tspsolver.TSPSolverResult and
+            whether the solver was started from the previous frame's tour.
+            The SVG file of a frame may still be being written; all of them
+            are written by the time the generator is exhausted.
+
+    """
+    cold = get_solver(backend, **options)
+    warm_options = dict(options)
+    if warm_timeout is not None:
+        warm_options['timeout'] = warm_timeout
+    if not cold.available():
+        raise RuntimeError('Solver backend {} is not available'.format(cold.name))
+
+    # Loading and writing is done by worker threads while the solver runs
+    # on this one.  The external solvers run in processes of their own so
+    # the threads do not hold them up.
+    with ThreadPoolExecutor(max_workers=prefetch + 2) as pool:
+        loads = {}
+        writes = []
+        previous = None
+        for k in range(len(sources)):
+            for ahead in range(k, min(k + prefetch + 1, len(sources))):
+                if ahead not in loads:
+                    loads[ahead] = pool.submit(load_cities, sources[ahead])
+            cities = loads.pop(k).result()
+
+            stats = {}
+            initial_tour = transfer_tour(previous[0], previous[1].tour, cities, stats) if previous else None
+            if initial_tour is None:
+                solver = cold
+            else:
+                frame_options = dict(warm_options)
+                if 'warm_kicks' not in options:
+                    frame_options['warm_kicks'] = min(len(cities.coordinates), max(
+                        LinkernSolver.WARM_KICKS_MIN, WARM_KICKS_PER_CHANGED_CITY * stats['changed']))
+                solver = get_solver(backend, **frame_options)
+            result = solver.solve(cities, initial_tour)
+            previous = cities, result
+
+            if output_paths is not None:
+                writes.append(pool.submit(_write_frame, cities, result.tour, output_paths[k],
+                                          max_segments, line_color, compact, compress))
+            yield cities, result, initial_tour is not None
+
+        for write in writes:
+            write.result()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Generate TSP art SVG files for a sequence of frames')
+    parser.add_argument('inputs', nargs='+', help='Input files (PBM, PGM or PTS), one per frame, in order')
+    parser.add_argument('-o', '--output-dir', type=str, default=None,
+                        help='Directory for the SVG files; defaults to that of each input file')
+    parser.add_argument('-m', '--max-segments', type=int, default=40000000000000,
+                        help='Maximum number of line segments per SVG <path> element')
+    parser.add_argument('-C', '--compact', action='store_const', const='gocupi', default=None,
+                        help='Write compact SVG path data which gocupi still reads; see tspart.py')
+    parser.add_argument('--full-compact', action='store_const', const='full', dest='compact',
+                        help='Write the shortest SVG path data; see tspart.py')
+    parser.add_argument('-z', '--svgz', action="store_true", help='Write gzip compressed .svgz files')
+    parser.add_argument('-r', '--runs', type=int, default=1, help='Number of linkern runs to take')
+    parser.add_argument('-s', '--stroke', type=str, default='#000000', help='Stroke (line) color (e.g., black, green, #000000')
+    parser.add_argument('-S', '--solver', type=str, default='linkern', help='Path to the linkern executable')
+    parser.add_argument('-b', '--backend', type=str, default='linkern', choices=sorted(SOLVERS),
+                        help='Solver backend; see tspart.py')
+    parser.add_argument('--concorde', type=str, default='concorde', help='Path to the concorde executable')
+    parser.add_argument('-t', '--time-budget', type=float, default=None, help='Seconds the solver may take on the first frame')
+    parser.add_argument('-w', '--warm-time-budget', type=float, default=None,
+                        help='Seconds the solver may take on each later frame; defaults to --time-budget')
+    parser.add_argument('-K', '--warm-kicks', type=int, default=None,
+                        help='Number of linkern kicks on each later frame; by default scaled to the number '
+                             'of stipples which changed since the previous frame')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='Megabytes of resident memory an external solver may use before it is stopped')
+    parser.add_argument('-j', '--prefetch', type=int, default=2, help='Number of frames to load ahead')
+    args = parser.parse_args()
+
+    output_paths = []
+    for infile in args.inputs:
+        if not os.path.exists(infile):
+            sys.stderr.write('File "{}" does not exist!\n'.format(infile))
+            sys.exit(1)
+        raw_path_without_ext = os.path.splitext(os.path.abspath(infile))[0]
+        if args.output_dir:
+            raw_path_without_ext = os.path.join(args.output_dir, os.path.basename(raw_path_without_ext))
+        output_paths.append(raw_path_without_ext + ('.svgz' if args.svgz else '.svg'))
+
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    solver_options = dict(timeout=args.time_budget, max_memory=max_memory, linkern=args.solver,
+                          concorde=args.concorde, runs=args.runs)
+    if args.warm_kicks is not None:
+        solver_options['warm_kicks'] = args.warm_kicks
+    frames = solve_sequence(args.inputs, output_paths, args.backend, args.warm_time_budget, args.prefetch,
+                            args.max_segments, args.stroke, args.compact, True if args.svgz else None,
+                            **solver_options)
+
+    elapsed = {False: [], True: []}
+    try:
+        for k, (cities, result, warm) in enumerate(frames):
+            elapsed[warm].append(result.elapsed)
+            print('Frame {:d} ({}): {} stipples; {} solve by {}, tour length {:d} in {:.2f} seconds{}'.format(
+                k + 1, output_paths[k], len(cities.coordinates), 'warm' if warm else 'cold', result.solver,
+                result.length, result.elapsed,
+                ' (stopped on reaching its {} limit)'.format(result.stopped) if result.stopped else ''))
+    except (RuntimeError, ValueError) as e:
+        sys.stderr.write('{}\n'.format(e))
+        sys.exit(1)
+
+    for warm in (False, True):
+        if elapsed[warm]:
+            print('{:d} {} solves averaging {:.2f} seconds'.format(
+                len(elapsed[warm]), 'warm' if warm else 'cold', sum(elapsed[warm]) / len(elapsed[warm])))
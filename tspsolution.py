@@ -22,6 +22,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import io
 import sys
 
 
@@ -73,12 +74,30 @@ class TSPSolution(object):
         return True
 
     def load(self, infile):
+        with open(infile, 'r') as f:
+            return self.load_fileobj(f, infile)
+
+    def loads(self, text, infile='<string>'):
+        """
+        Load a tour from the in-memory contents of a solution file
+
+        Args:
+            text (str): Contents of a concorde or linkern solution file
+            infile (str): Name used in error messages
+
+        Returns:
+            bool: loading status
+
+        """
+        if isinstance(text, bytes):
+            text = text.decode('ascii')
+        return self.load_fileobj(io.StringIO(text), infile)
+
+    def load_fileobj(self, f, infile='<stream>'):
         self.count = 0
         self.tour = []
         self.infile = infile
 
-        f = open(infile, 'r')
-
         line = f.readline().strip()
         vals = line.split(' ')
         if len(vals) == 1:
@@ -90,11 +109,9 @@ class TSPSolution(object):
             self.count = int(vals[0])
             ok = self.__load_linkern(f)
         else:
-            f.close()
             sys.stderr.write('Input file {} has unknown format\n'.format(self.infile))
             return False
 
-        f.close()
         if not ok:
             return False
 
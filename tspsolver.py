@@ -0,0 +1,703 @@
+# coding=utf-8
+# tspsolver.py
+#
+# TSP solver backends.  Each backend takes a TSPBitCity and produces a
+# closed tour through its cities along with the length of that tour and
+# the time taken to find it.
+#
+#    linkern   -- Fast, heuristic (chained Lin-Kernighan) solver from Concorde TSP
+#    concorde  -- Exact solver from Concorde TSP; only sensible for small maps
+#    inprocess -- Pure Python space filling curve tour improved with 2-opt.
+#                 Needs no external programs, but is far slower than linkern
+#    tiled     -- Splits the map into tiles, solves the tiles in parallel
+#                 with another backend and then stitches the tours together
+#    auto      -- Picks one of the above from the number of cities and the
+#                 time budget
+#
+# Backends are looked up by name with get_solver():
+#
+#    solver = get_solver('auto', timeout=60)
+#    result = solver.solve(cities)
+#    print(result.solver, result.length, result.elapsed)
+#
+# Further backends may be added by subclassing TSPSolver and decorating the
+# subclass with @register_solver.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import math
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from tspbitcity import TSPBitCity
+from tspsolution import TSPSolution
+from tspsupervisor import SupervisedProcess
+
+# Registry of the known backends, keyed by backend name
+SOLVERS = {}
+
+# Seconds an external solver may overrun its time limit before it is
+# stopped
+TIMEOUT_GRACE = 1.0
+
+
+def register_solver(cls):
+    """
+    Class decorator adding a TSPSolver subclass to the registry
+    """
+    SOLVERS[cls.name] = cls
+    return cls
+
+
+def get_solver(name, **options):
+    """
+    Instantiate a solver backend by name
+
+    Args:
+        name (str): Name of a registered backend.  A TSPSolver instance is
+            returned as is.
+        **options: Passed on to the backend; see TSPSolver
+
+    Returns:
+        TSPSolver: the backend
+
+    """
+    if isinstance(name, TSPSolver):
+        return name
+    if name not in SOLVERS:
+        raise ValueError('Unknown solver backend "{}"; choose from {}'.format(
+            name, ', '.join(sorted(SOLVERS))))
+    return SOLVERS[name](**options)
+
+
+def tour_length(coordinates, tour):
+    """
+    Length of a tour using the TSPLIB EUC_2D metric, distances rounded to
+    the nearest integer
+
+    Args:
+        coordinates (list): City (x, y) coordinates
+        tour (list): City indices; a closed tour ends at its first city
+
+    Returns:
+        int: the tour length
+
+    """
+    length = 0
+    previous = None
+    for city_idx in tour:
+        city = coordinates[int(city_idx)]
+        if previous is not None:
+            length += int(math.hypot(city[0] - previous[0], city[1] - previous[1]) + 0.5)
+        previous = city
+    return length
+
+
+class TSPSolverLimit(RuntimeError):
+    def __init__(self, reason, tour=None):
+        """
+        Raised by a backend which was stopped on hitting a time or memory limit
+
+        Args:
+            reason (str): 'timeout' or 'memory'
+            tour (list): The best tour found before the solver was stopped, if any
+        """
+        super(TSPSolverLimit, self).__init__('Solver stopped on reaching its {} limit'.format(reason))
+        self.reason = reason
+        self.tour = tour
+
+
+class TSPSolverResult(object):
+    def __init__(self, tour, length, elapsed, solver, stopped=None):
+
+        # The closed tour as a list of city indices; the last index
+        # repeats the first
+        self.tour = tour
+
+        # Length of the tour, see tour_length()
+        self.length = length
+
+        # Wall clock seconds spent solving
+        self.elapsed = elapsed
+
+        # Name of the backend which produced the tour
+        self.solver = solver
+
+        # None when the solver finished, otherwise the limit it was
+        # stopped at ('timeout' or 'memory').  The tour is then the best
+        # one found before the solver was stopped, or failing that a
+        # quick space filling curve tour.
+        self.stopped = stopped
+
+
+class TSPSolver(object):
+
+    # Name under which the backend is registered
+    name = None
+
+    # Capabilities of the backend, which the auto backend chooses by:
+    #
+    #   exact     -- tours are provably optimal
+    #   external  -- an external program is run, see available()
+    #   composite -- the backend combines other backends
+    #   max_cities -- largest map the backend is suited for, None if unbounded
+    #   cities_per_second -- rough throughput, used to judge whether the
+    #                backend can finish within a time budget; None if unknown
+    exact = False
+    external = False
+    composite = False
+    max_cities = None
+    cities_per_second = None
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, **options):
+        """
+        Args:
+            timeout (float): Wall clock seconds the backend may take; None
+                for no limit
+            max_memory (int): Bytes of resident memory an external solver
+                may use; None for no limit
+            progress (list): Callables given each tspsupervisor.TSPProgressEvent
+                of an external solver
+            **options: Backend specific options.  Options a backend does not
+                know of are ignored so that one set of options may be handed
+                to whichever backend is selected.
+        """
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.progress = list(progress or [])
+        self.options = options
+
+    def available(self):
+        """
+        Returns:
+            bool: whether the backend can be used on this system
+        """
+        return True
+
+    def solve(self, cities, initial_tour=None):
+        """
+        Find a closed tour through the cities
+
+        Args:
+            cities (TSPBitCity): the cities to visit
+            initial_tour (list): A tour, open or closed, to start from
+                rather than building one from scratch, e.g., that of a
+                similar map; see tspsequence.transfer_tour().  Backends
+                which cannot make use of it ignore it.
+
+        Returns:
+            TSPSolverResult: the tour, its length and the solve time
+
+        """
+        start = time.time()
+        stopped = None
+        count = len(cities.coordinates)
+        if initial_tour is not None:
+            initial_tour = _open_tour(initial_tour, count)
+        if count < 4:
+            # Every tour through three or fewer cities is optimal
+            tour = list(range(count))
+        else:
+            try:
+                tour = self._solve(cities, initial_tour)
+            except TSPSolverLimit as e:
+                # Fall back to the best tour available
+                stopped = e.reason
+                tour = e.tour or initial_tour or _hilbert_tour(cities)
+
+        # Close the tour by returning to the starting city
+        if tour and tour[0] != tour[-1]:
+            tour.append(tour[0])
+
+        return TSPSolverResult(tour, tour_length(cities.coordinates, tour),
+                               time.time() - start, self.name, stopped)
+
+    def _solve(self, cities, initial_tour=None):
+        """
+        Backend specific solving.  Only called for maps of four or more cities.
+
+        Args:
+            cities (TSPBitCity): the cities to visit
+            initial_tour (list): Open tour to start from, or None
+
+        Returns:
+            list: City indices of the tour, either open or closed
+        """
+        raise NotImplementedError
+
+    def _solve_external(self, cities, cmd_for, initial_tour=None):
+        """
+        Hand the cities to an external solver via a TSPLIB file in a
+        temporary directory and read back its tour
+
+        Args:
+            cities (TSPBitCity): the cities to visit
+            cmd_for (callable): Given the TSPLIB, tour, intermediate tour
+                and initial tour file paths, returns (command line, timeout).
+                The initial tour file path is None when there is no
+                initial tour.
+            initial_tour (list): Open tour to write to the initial tour file
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            tspfile_path = os.path.join(tmp_dir, 'tspart.tsp')
+            solution_filepath = os.path.join(tmp_dir, 'tspart.tour')
+            save_filepath = os.path.join(tmp_dir, 'tspart.save')
+            cities.write_tspfile(tspfile_path)
+
+            initial_filepath = None
+            if initial_tour is not None:
+                # Concorde's cycle format: the number of cities followed
+                # by the city indices in tour order
+                initial_filepath = os.path.join(tmp_dir, 'tspart.init')
+                with open(initial_filepath, 'w') as f:
+                    f.write('{:d}\n'.format(len(initial_tour)))
+                    f.write('\n'.join(map(str, initial_tour)))
+                    f.write('\n')
+
+            cmd, timeout = cmd_for(tspfile_path, solution_filepath, save_filepath, initial_filepath)
+            process = SupervisedProcess(cmd, tmp_dir, timeout, self.max_memory, self.progress)
+            status = process.run()
+
+            solution = TSPSolution()
+            if process.stopped:
+                # Use the solver's last saved tour, if it got that far
+                tour = None
+                if os.path.exists(save_filepath) and solution.load(save_filepath) and \
+                        solution.count == len(cities.coordinates):
+                    tour = [int(city_idx) for city_idx in solution.tour]
+                raise TSPSolverLimit(process.stopped, tour)
+
+            if status:
+                raise RuntimeError('Solver failed; status = {}'.format(status))
+
+            if not solution.load(solution_filepath):
+                raise RuntimeError('Unable to load the solution file')
+        finally:
+            # Remove the temporary directory along with the TSPLIB and tour files
+            shutil.rmtree(tmp_dir)
+
+        return [int(city_idx) for city_idx in solution.tour]
+
+
+def _open_tour(tour, count):
+    """
+    Check that a tour, open or closed, visits each of count cities once
+
+    Returns:
+        list: the tour without the closing return to the first city
+    """
+    tour = [int(city) for city in tour]
+    if len(tour) == count + 1 and count and tour[0] == tour[-1]:
+        tour.pop()
+    if len(tour) != count or len(set(tour)) != count or (count and (min(tour) < 0 or max(tour) >= count)):
+        raise ValueError('The initial tour does not visit each of the {:d} cities once'.format(count))
+    return tour
+
+
+def _resolve_executable(executable):
+    """
+    Make an executable path independent of the working directory, as
+    external solvers are run from within a temporary directory
+
+    Returns:
+        str: the absolute path of an executable given with a directory,
+            otherwise the executable as found on the PATH (or as given
+            should it not be found)
+    """
+    if any(sep in executable for sep in (os.sep, os.altsep) if sep):
+        return os.path.abspath(executable)
+    return shutil.which(executable) or executable
+
+
+def _executable_available(executable):
+    return bool(shutil.which(executable)) or os.path.isfile(executable)
+
+
+@register_solver
+class LinkernSolver(TSPSolver):
+    name = 'linkern'
+    external = True
+    max_cities = 1000000
+    cities_per_second = 20000
+
+    # Most of linkern's time goes on its kicks, of which it makes one per
+    # city by default.  Starting from an initial tour, which is good
+    # already, it makes this fraction of that, but at least WARM_KICKS_MIN.
+    WARM_KICKS_FRACTION = 0.1
+    WARM_KICKS_MIN = 100
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, linkern='linkern', runs=1,
+                 warm_kicks=None, **options):
+        """
+        Args:
+            linkern (str): Path to the linkern executable
+            runs (int): Number of linkern runs to take
+            warm_kicks (int): Number of kicks linkern makes when started
+                from an initial tour; see WARM_KICKS_FRACTION for the default
+        """
+        super(LinkernSolver, self).__init__(timeout, max_memory, progress, **options)
+        self.executable = _resolve_executable(linkern)
+        self.runs = runs
+        self.warm_kicks = warm_kicks
+
+    def available(self):
+        return _executable_available(self.executable)
+
+    def _command(self, tspfile_path, solution_filepath, save_filepath, initial_filepath, kicks=None):
+        # -S has linkern save its best tour as it goes, which we fall
+        # back on should it have to be stopped
+        cmd = [self.executable, '-r', str(self.runs), '-o', solution_filepath, '-S', save_filepath]
+        if initial_filepath:
+            # Start the Lin-Kernighan search from the given tour rather
+            # than from a greedy one
+            cmd += ['-I', initial_filepath]
+        if kicks is not None:
+            # -R sets the number of kicks (-K would select the kind of kick)
+            cmd += ['-R', str(kicks)]
+        timeout = None
+        if self.timeout is not None:
+            # linkern stops improving its tour and writes it out once its
+            # own time bound is reached.  Should it overrun that bound, it is
+            # stopped TIMEOUT_GRACE seconds later and its saved tour is used.
+            cmd += ['-t', str(self.timeout)]
+            timeout = self.timeout + TIMEOUT_GRACE
+        return cmd + [tspfile_path], timeout
+
+    def _solve(self, cities, initial_tour=None):
+        kicks = None
+        if initial_tour is not None:
+            count = len(cities.coordinates)
+            kicks = self.warm_kicks
+            if kicks is None:
+                kicks = min(count, max(self.WARM_KICKS_MIN, int(count * self.WARM_KICKS_FRACTION)))
+        return self._solve_external(cities, partial(self._command, kicks=kicks), initial_tour)
+
+
+@register_solver
+class ConcordeSolver(TSPSolver):
+    name = 'concorde'
+    exact = True
+    external = True
+    max_cities = 2000
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, concorde='concorde', **options):
+        """
+        Args:
+            concorde (str): Path to the concorde executable
+        """
+        super(ConcordeSolver, self).__init__(timeout, max_memory, progress, **options)
+        self.executable = _resolve_executable(concorde)
+
+    def available(self):
+        return _executable_available(self.executable)
+
+    def _command(self, tspfile_path, solution_filepath, save_filepath, initial_filepath):
+        # -x removes the many intermediate files concorde leaves behind.
+        # Concorde proves optimality regardless of where it starts so the
+        # initial tour is not passed on.
+        return [self.executable, '-x', '-o', solution_filepath, tspfile_path], self.timeout
+
+    def _solve(self, cities, initial_tour=None):
+        return self._solve_external(cities, self._command)
+
+
+def _hilbert_key(x, y, side):
+    """
+    Distance along a Hilbert curve filling a side x side grid of the
+    point (x, y); side must be a power of two
+    """
+    d = 0
+    s = side >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x = side - 1 - x
+                y = side - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def _hilbert_tour(cities):
+    """
+    Quick tour visiting the cities in the order of a Hilbert curve
+    """
+    coordinates = cities.coordinates
+    side = 1
+    while side < max(cities.width, cities.height, 1):
+        side <<= 1
+    return sorted(range(len(coordinates)), key=lambda i: _hilbert_key(coordinates[i][0], coordinates[i][1], side))
+
+
+@register_solver
+class InProcessSolver(TSPSolver):
+    name = 'inprocess'
+    max_cities = 100000
+    cities_per_second = 5000
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, window=50, **options):
+        """
+        Args:
+            window (int): 2-opt only considers exchanging edges which are
+                no more than this many cities apart along the tour
+        """
+        super(InProcessSolver, self).__init__(timeout, max_memory, progress, **options)
+        self.window = window
+
+    def _solve(self, cities, initial_tour=None):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        coordinates = cities.coordinates
+        count = len(coordinates)
+
+        if initial_tour is not None:
+            # Repair the given tour
+            tour = list(initial_tour)
+        else:
+            tour = _hilbert_tour(cities)
+
+        # Then improve it with 2-opt moves until no more are found or
+        # we run out of time.  Cities wait in a queue to have the edge to
+        # their successor looked at; once a city's edge yields no move it
+        # is only looked at again should a move touch it.  A tour which is
+        # already good, such as an initial tour, is thus repaired in about
+        # a single pass.
+        xs = [city[0] for city in coordinates]
+        ys = [city[1] for city in coordinates]
+        hypot = math.hypot
+        position = [0] * count
+        for k, city in enumerate(tour):
+            position[city] = k
+        pending = deque(tour)
+        queued = [True] * count
+        checks = 0
+        while pending:
+            checks += 1
+            if deadline is not None and not checks & 255 and time.time() > deadline:
+                raise TSPSolverLimit('timeout', tour)
+            a = pending.popleft()
+            queued[a] = False
+            i = position[a]
+            if i >= count - 2:
+                continue
+            b = tour[i + 1]
+            d_ab = hypot(xs[a] - xs[b], ys[a] - ys[b])
+            for j in range(i + 2, min(i + self.window, count)):
+                if i == 0 and j == count - 1:
+                    # Edges (a, b) and (c, d) would be adjacent
+                    continue
+                c, d = tour[j], tour[(j + 1) % count]
+                delta = (hypot(xs[a] - xs[c], ys[a] - ys[c]) + hypot(xs[b] - xs[d], ys[b] - ys[d]) -
+                         d_ab - hypot(xs[c] - xs[d], ys[c] - ys[d]))
+                if delta < -1e-9:
+                    tour[i + 1:j + 1] = tour[j:i:-1]
+                    for k in range(i + 1, j + 1):
+                        position[tour[k]] = k
+                    # Look again at the cities whose window reaches the
+                    # new edges (a, c) and (b, d)
+                    for k in range(max(0, i - self.window + 1), j + 1):
+                        city = tour[k]
+                        if not queued[city]:
+                            pending.append(city)
+                            queued[city] = True
+                    b = tour[i + 1]
+                    d_ab = hypot(xs[a] - xs[b], ys[a] - ys[b])
+        return tour
+
+
+@register_solver
+class TiledSolver(TSPSolver):
+    name = 'tiled'
+    composite = True
+
+    # Default number of cities per tile, unless the tile backend's
+    # max_cities is smaller
+    TILE_CITIES = 100000
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, tile_backend='linkern',
+                 tile_cities=None, workers=None, **options):
+        """
+        Args:
+            tile_backend (str): Backend used to solve each tile
+            tile_cities (int): Approximate number of cities per tile
+            workers (int): Number of tiles solved concurrently; defaults
+                to the number of CPUs
+        """
+        super(TiledSolver, self).__init__(timeout, max_memory, progress, **options)
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = get_solver(tile_backend, timeout=timeout, max_memory=max_memory, **options)
+        if tile_cities is None:
+            tile_cities = min(self.TILE_CITIES, self.backend.max_cities or self.TILE_CITIES)
+        self.tile_cities = tile_cities
+
+    def available(self):
+        return self.backend.available()
+
+    def _solve(self, cities, initial_tour=None):
+        # Tiles are solved from scratch; an initial tour is ignored
+        coordinates = cities.coordinates
+        count = len(coordinates)
+
+        # Split the map into a square grid of tiles and visit the tiles
+        # row by row, alternating direction from one row to the next
+        ntiles = max(1, int(math.ceil(math.sqrt(count / self.tile_cities))))
+        tile_width = max(1, int(math.ceil(cities.width / ntiles)))
+        tile_height = max(1, int(math.ceil(cities.height / ntiles)))
+        members = {}
+        for i, (x, y) in enumerate(coordinates):
+            members.setdefault((min(x // tile_width, ntiles - 1), min(y // tile_height, ntiles - 1)), []).append(i)
+        order = []
+        for row in range(ntiles):
+            columns = range(ntiles) if row % 2 == 0 else range(ntiles - 1, -1, -1)
+            order += [members[(column, row)] for column in columns if (column, row) in members]
+
+        # Solve the tiles
+        stopped = []
+
+        def solve_tile(indices):
+            tile = TSPBitCity()
+            tile.set_coordinates([coordinates[i] for i in indices], cities.width, cities.height)
+            result = self.backend.solve(tile)
+            if result.stopped:
+                stopped.append(result.stopped)
+            tour = result.tour
+            if len(tour) > 1 and tour[0] == tour[-1]:
+                # Open the closed tour; a lone city's tour is just [0]
+                tour = tour[:-1]
+            return [indices[j] for j in tour]
+
+        # Share out the time budget among the rounds of concurrently solved tiles
+        if self.timeout is not None:
+            rounds = int(math.ceil(len(order) / self.workers))
+            self.backend.timeout = self.timeout / rounds
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            tile_tours = [cycle for cycle in pool.map(solve_tile, order) if cycle]
+
+        # Stitch the tours together.  Each tile's cycle is opened by removing
+        # the edge which best connects the end of the previous tile's path
+        # with the centroid of the next tile.
+        def dist(p, q):
+            return math.hypot(p[0] - q[0], p[1] - q[1])
+
+        tour = []
+        for k, cycle in enumerate(tile_tours):
+            if k + 1 < len(tile_tours):
+                following = [coordinates[i] for i in tile_tours[k + 1]]
+                target = (sum(p[0] for p in following) / len(following),
+                          sum(p[1] for p in following) / len(following))
+            else:
+                target = coordinates[tour[0]] if tour else coordinates[cycle[0]]
+            source = coordinates[tour[-1]] if tour else (0, 0)
+
+            best = None
+            m = len(cycle)
+            for i in range(m):
+                u, v = coordinates[cycle[i]], coordinates[cycle[(i + 1) % m]]
+                removed = dist(u, v)
+                # Enter at v and leave at u, or enter at u and leave at v
+                for cost, entry, reverse in ((dist(source, v) + dist(u, target) - removed, i + 1, False),
+                                             (dist(source, u) + dist(v, target) - removed, i, True)):
+                    if best is None or cost < best[0]:
+                        best = (cost, entry, reverse)
+
+            _, entry, reverse = best
+            entry %= m
+            if reverse:
+                path = cycle[entry::-1] + cycle[:entry:-1]
+            else:
+                path = cycle[entry:] + cycle[:entry]
+            tour += path
+
+        if stopped:
+            # Some tiles were stopped on reaching a limit
+            raise TSPSolverLimit(stopped[0], tour)
+        return tour
+
+
+@register_solver
+class AutoSolver(TSPSolver):
+    name = 'auto'
+    composite = True
+
+    # Exact backends are only chosen when the time budget, if any, is at
+    # least this many seconds
+    EXACT_MIN_TIMEOUT = 10
+
+    def __init__(self, timeout=None, max_memory=None, progress=None, **options):
+        super(AutoSolver, self).__init__(timeout, max_memory, progress, **options)
+
+    def select(self, count):
+        """
+        Choose a backend for a map of count cities by the capabilities
+        the backends declare:
+
+          1. an available exact backend, should the map be within its
+             max_cities and the time budget allow
+          2. otherwise an available heuristic backend, external ones first
+             as they are much faster.  Should the map exceed its max_cities
+             or its cities_per_second suggest that it would overrun the
+             time budget, the map is tiled with it instead.
+
+        Args:
+            count (int): the number of cities
+
+        Returns:
+            TSPSolver: the chosen backend
+
+        """
+        def make(name, **extra):
+            options = dict(self.options)
+            options.update(extra)
+            return get_solver(name, timeout=self.timeout, max_memory=self.max_memory,
+                              progress=self.progress, **options)
+
+        def fits(cls):
+            return cls.max_cities is None or count <= cls.max_cities
+
+        backends = [cls for _, cls in sorted(SOLVERS.items()) if not cls.composite]
+
+        if self.timeout is None or self.timeout >= self.EXACT_MIN_TIMEOUT:
+            for cls in backends:
+                if cls.exact and fits(cls):
+                    solver = make(cls.name)
+                    if solver.available():
+                        return solver
+
+        for cls in sorted((cls for cls in backends if not cls.exact), key=lambda cls: not cls.external):
+            solver = make(cls.name)
+            if not solver.available():
+                continue
+            too_slow = self.timeout is not None and cls.cities_per_second is not None and \
+                count / cls.cities_per_second > self.timeout
+            if fits(cls) and not too_slow:
+                return solver
+            return make('tiled', tile_backend=solver)
+
+        raise RuntimeError('No solver backend is available')
+
+    def available(self):
+        return True
+
+    def solve(self, cities, initial_tour=None):
+        return self.select(len(cities.coordinates)).solve(cities, initial_tour)
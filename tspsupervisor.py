@@ -0,0 +1,267 @@
+# coding=utf-8
+# tspsupervisor.py
+#
+# Run an external TSP solver under supervision.  The solver's output is
+# read line by line and turned into progress events (such as a new best
+# tour length) which are handed to callbacks, e.g., a progress bar.  The
+# solver is stopped should it run past its wall clock limit or should its
+# resident memory (RSS) grow past its limit.
+#
+#    process = SupervisedProcess(cmd, timeout=60, max_rss=2 << 30,
+#                                callbacks=[ProgressBar(60)])
+#    status = process.run()
+#    if process.stopped:
+#        ...  # 'timeout' or 'memory'; fall back to the best tour so far
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+# Tour lengths reported by linkern, e.g.,
+#
+#    LK Initial Run: 6178.0
+#    1 Steps   Best: 6110.00   0.01 seconds
+#    Final Len: 6062.0
+#    Run 0: 6062.0 (0.35 seconds)
+#
+# and by concorde, e.g.,
+#
+#    Initial bound: 6000.00
+#    Optimal Solution: 6062.00
+#
+# Each pattern is paired with the kind of event it produces.  Lines which
+# match none of them produce 'output' events.
+SOLVER_PATTERNS = [
+    (re.compile(r'Initial Run:\s*([0-9.]+)'), 'initial'),
+    (re.compile(r'Best:\s*([0-9.]+)'), 'improved'),
+    (re.compile(r'(?:Final Len|Run \d+):\s*([0-9.]+)'), 'run'),
+    (re.compile(r'Optimal Solution:\s*([0-9.]+)'), 'final'),
+]
+
+# Seconds to wait for a solver to exit after asking it to terminate
+# before killing it
+TERMINATE_GRACE = 5.0
+
+
+class TSPProgressEvent(object):
+    def __init__(self, kind, line, elapsed, length=None, best_length=None):
+
+        # One of 'initial', 'improved', 'run', 'final' or 'output'
+        self.kind = kind
+
+        # The line of solver output the event came from
+        self.line = line
+
+        # Wall clock seconds since the solver was started
+        self.elapsed = elapsed
+
+        # Tour length reported on this line, if any
+        self.length = length
+
+        # Shortest tour length reported so far, if any
+        self.best_length = best_length
+
+
+def parse_solver_line(line):
+    """
+    Pick a tour length out of a line of solver output
+
+    Returns:
+        tuple: (kind, length), with a length of None for 'output' lines
+    """
+    for pattern, kind in SOLVER_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            return kind, float(match.group(1).rstrip('.'))
+    return 'output', None
+
+
+def process_rss(pid):
+    """
+    Resident memory of a process in bytes, or None where it cannot be
+    determined (only Linux' /proc is consulted)
+    """
+    try:
+        with open('/proc/{:d}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class SupervisedProcess(object):
+    def __init__(self, cmd, cwd=None, timeout=None, max_rss=None, callbacks=(),
+                 poll_interval=0.25):
+        """
+        Args:
+            cmd (list): Command line of the solver
+            cwd (str): Working directory for the solver
+            timeout (float): Wall clock seconds the solver may run; None for no limit
+            max_rss (int): Bytes of resident memory the solver may use; None
+                for no limit.  Where the RSS cannot be read, this is applied
+                as an address space limit (RLIMIT_AS) instead.
+            callbacks (list): Callables each given every TSPProgressEvent
+            poll_interval (float): Seconds between checks of the limits
+        """
+        self.cmd = cmd
+        self.cwd = cwd
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.callbacks = list(callbacks)
+        self.poll_interval = poll_interval
+
+        # Shortest tour length reported by the solver
+        self.best_length = None
+
+        # Why the solver was stopped: None, 'timeout' or 'memory'
+        self.stopped = None
+
+        # Wall clock seconds the solver ran
+        self.elapsed = 0.0
+
+    def _emit(self, line, start):
+        kind, length = parse_solver_line(line)
+        if length is not None and (self.best_length is None or length < self.best_length):
+            self.best_length = length
+        event = TSPProgressEvent(kind, line, time.time() - start, length, self.best_length)
+        for callback in self.callbacks:
+            callback(event)
+
+    def _preexec(self):
+        # Only used where the RSS cannot be watched, see run()
+        resource.setrlimit(resource.RLIMIT_AS, (int(self.max_rss), int(self.max_rss)))
+
+    def run(self):
+        """
+        Run the solver to completion or until it is stopped
+
+        Returns:
+            int: the solver's exit status
+        """
+        start = time.time()
+        kwargs = {}
+        if self.max_rss is not None and resource is not None and not os.path.isdir('/proc/self'):
+            # Without /proc we cannot watch the RSS, so cap the address
+            # space instead; the solver will then fail its allocations
+            # rather than being stopped by us.  preexec_fn is avoided
+            # otherwise as it is unsafe with threads running and rules out
+            # the faster ways of starting the process.
+            kwargs['preexec_fn'] = self._preexec
+        process = subprocess.Popen(self.cmd, cwd=self.cwd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, universal_newlines=True, **kwargs)
+
+        # A thread reads the solver's output so that the limits can be
+        # checked here even while the solver is quiet
+        lines = queue.Queue()
+
+        def reader():
+            for line in iter(process.stdout.readline, ''):
+                lines.put(line.rstrip('\n'))
+            lines.put(None)
+
+        thread = threading.Thread(target=reader)
+        thread.daemon = True
+        thread.start()
+
+        finished = False
+        while not finished:
+            try:
+                line = lines.get(timeout=self.poll_interval)
+                if line is None:
+                    finished = True
+                else:
+                    self._emit(line, start)
+            except queue.Empty:
+                pass
+
+            if process.poll() is not None or self.stopped:
+                continue
+
+            if self.timeout is not None and time.time() - start > self.timeout:
+                self.stopped = 'timeout'
+            elif self.max_rss is not None and (process_rss(process.pid) or 0) > self.max_rss:
+                self.stopped = 'memory'
+            if self.stopped:
+                self._terminate(process)
+
+        status = process.wait()
+        thread.join()
+        process.stdout.close()
+        self.elapsed = time.time() - start
+        return status
+
+    def _terminate(self, process):
+        process.terminate()
+        deadline = time.time() + TERMINATE_GRACE
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.kill()
+
+
+class ProgressBar(object):
+    def __init__(self, timeout=None, width=30, stream=None):
+        """
+        Progress callback drawing a single, continually updated status line
+
+        Args:
+            timeout (float): Time limit of the solver.  With a limit the bar
+                fills as time runs out; without one, a spinner is shown.
+            width (int): Width of the bar in characters
+            stream (file): Where to draw; defaults to stderr
+        """
+        self.timeout = timeout
+        self.width = width
+        self.stream = stream or sys.stderr
+        self.ticks = 0
+
+    def __call__(self, event):
+        if event.best_length is None:
+            return
+        if self.timeout:
+            filled = min(self.width, int(self.width * event.elapsed / self.timeout))
+            bar = '[' + '#' * filled + ' ' * (self.width - filled) + ']'
+        else:
+            bar = '[' + '|/-\\'[self.ticks % 4] + ']'
+            self.ticks += 1
+        self.stream.write('\r{} best {:.0f}  {:.1f}s '.format(bar, event.best_length, event.elapsed))
+        self.stream.flush()
+
+    def close(self):
+        """
+        End the status line
+        """
+        self.stream.write('\n')
+        self.stream.flush()
+
+
+def echo_output(event):
+    """
+    Progress callback printing the solver's output as is
+    """
+    print(event.line)